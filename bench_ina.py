@@ -0,0 +1,809 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import json
+import time
+import types
+import curses
+import shutil
+import select
+import argparse
+import subprocess
+import tempfile
+import threading
+import contextlib
+import tracemalloc
+from pathlib import Path
+from collections import Counter, deque
+
+import ina
+
+STARTUP_BUDGET_MS = 150
+
+
+class KeyFeed:
+    def __init__(self, events):
+        self.events = deque(events)
+        self.current = deque()
+        self.due = 0
+        self.timer = None
+        self.ended = False
+        self.arrived = None
+        self.done = 0
+        self.latencies = []
+        self.keys = 0
+        self.read_fd, self.write_fd = os.pipe()
+        self._ready = False
+        self._schedule()
+
+    def fileno(self):
+        return self.read_fd
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+    def _signal(self):
+        if not self._ready:
+            self._ready = True
+            os.write(self.write_fd, b"k")
+
+    def _schedule(self):
+        while self.events and self.events[0][0] == "wait":
+            self.due = time.perf_counter() + self.events.popleft()[1]
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        left = self.due - time.perf_counter()
+        if left > 0:
+            self.timer = threading.Timer(left, self._signal)
+            self.timer.start()
+        else:
+            self._signal()
+
+    def refreshed(self):
+        self.done = time.perf_counter()
+
+    def _finish(self):
+        if self.arrived is not None:
+            self.latencies.append(max(self.done, self.arrived) - self.arrived)
+            self.arrived = None
+
+    def next_arrival(self, screen):
+        # The UI is asking for input again, so the previous arrival is done;
+        # its last refresh is when it reached the screen.
+        self._finish()
+        left = self.due - time.perf_counter()
+        if left > 0:
+            time.sleep(left)
+        if self._ready:
+            os.read(self.read_fd, 1)
+            self._ready = False
+        if self.events:
+            event = self.events.popleft()
+        else:
+            self.ended = True
+            event = ("keys", [ina.CTRL_X])
+        kind = event[0]
+        if kind == "resize":
+            screen.max_y, screen.max_x = event[1], event[2]
+            keys = [curses.KEY_RESIZE]
+        elif kind == "paste":
+            keys = [chr(k) if isinstance(k, int) else k
+                    for k in ina.PASTE_START]
+            keys.extend(event[1])
+            keys.extend(chr(k) if isinstance(k, int) else k
+                        for k in ina.PASTE_END)
+        else:
+            keys = list(event[1])
+        self.current.extend(keys)
+        self.keys += len(keys)
+        self.arrived = time.perf_counter()
+        self._schedule()
+
+    def finish(self):
+        self._finish()
+
+
+class FakeScreen:
+    def __init__(self, max_y=24, max_x=80, feed=None, calls=None):
+        self.max_y = max_y
+        self.max_x = max_x
+        self.y = 0
+        self.x = 0
+        self.calls = Counter() if calls is None else calls
+        self.chars = 0
+        self.feed = feed
+        self.delay = True
+
+    def reset_counts(self):
+        self.calls.clear()
+        self.chars = 0
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def getmaxyx(self):
+        return self.max_y, self.max_x
+
+    def getyx(self):
+        return self.y, self.x
+
+    def move(self, y, x):
+        self.calls["move"] += 1
+        self.y, self.x = y, x
+
+    def _newline(self):
+        self.x = 0
+        if self.y < self.max_y - 1:
+            self.y += 1
+
+    def addstr(self, *args):
+        self.calls["addstr"] += 1
+        if len(args) == 3:
+            self.y, self.x, text = args
+        else:
+            text = args[0]
+        self.chars += len(text)
+        for c in text:
+            if c == "\n":
+                self._newline()
+            else:
+                self.x += 1
+                if self.x >= self.max_x:
+                    self._newline()
+
+    def addnstr(self, y, x, text, n):
+        self.addstr(y, x, text[:n])
+
+    def clrtoeol(self):
+        self.calls["clrtoeol"] += 1
+
+    def clear(self):
+        self.calls["clear"] += 1
+        self.y = self.x = 0
+
+    def erase(self):
+        self.clear()
+
+    def chgat(self, y, x, attr):
+        self.calls["chgat"] += 1
+        self.y, self.x = y, x
+
+    def setscrreg(self, top, bottom):
+        self.calls["setscrreg"] += 1
+
+    def touchwin(self):
+        self.calls["touchwin"] += 1
+
+    def resize(self, max_y, max_x):
+        self.max_y, self.max_x = max_y, max_x
+
+    def scrollok(self, flag):
+        pass
+
+    def keypad(self, flag):
+        pass
+
+    def nodelay(self, flag):
+        self.delay = not flag
+
+    def refresh(self):
+        self.calls["refresh"] += 1
+        if self.feed is not None:
+            self.feed.refreshed()
+
+    def get_wch(self):
+        self.calls["get_wch"] += 1
+        feed = self.feed
+        if not feed.current and not self.delay:
+            raise curses.error("no input")
+        while not feed.current:
+            feed.next_arrival(self)
+        return feed.current.popleft()
+
+    def getkey(self):
+        return self.get_wch()
+
+    def getstr(self, y, x):
+        self.calls["getstr"] += 1
+        self.move(y, x)
+        feed = self.feed
+        if not feed.current:
+            feed.next_arrival(self)
+        line = "".join(feed.current).rstrip("\n")
+        feed.current.clear()
+        self.addstr(line)
+        return line.encode(ina.code)
+
+
+def fake_curses(screen):
+    calls = screen.calls
+
+    def counted(name, result=None):
+        def call(*args):
+            calls[name] += 1
+            return result
+        return call
+
+    def newwin(max_y, max_x, *args):
+        calls["newwin"] += 1
+        return FakeScreen(max_y, max_x, screen.feed, calls)
+
+    def unget(key):
+        calls["unget"] += 1
+        screen.feed.current.appendleft(key)
+
+    module = types.SimpleNamespace(
+        error=curses.error, ERR=curses.ERR, newwin=newwin,
+        unget_wch=unget, ungetch=unget,
+        beep=counted("beep"), flash=counted("flash"), echo=counted("echo"),
+        noecho=counted("noecho"),
+        use_default_colors=counted("use_default_colors"))
+    for name in dir(curses):
+        if name.startswith(("KEY_", "A_")):
+            setattr(module, name, getattr(curses, name))
+    return module
+
+
+def sample_text(size):
+    words = ("The quick brown fox jumps over the lazy dog, and then "
+             "it naps in the warm sun for a while.\n\n").split(" ")
+    out = []
+    total = 0
+    i = 0
+    while total < size:
+        w = words[i % len(words)]
+        out.append(w)
+        total += len(w) + 1
+        i += 1
+    return " ".join(out)[:size]
+
+
+def bench_render(args):
+    cases = [
+        ("tail (280 chars)", sample_text(280), False),
+        ("outline (40 KB)", sample_text(40 * 1024), False),
+        ("paste (4 KB)", sample_text(4 * 1024), False),
+        ("paste, one-line (4 KB)", sample_text(4 * 1024), True),
+    ]
+    print("{:<26} {:>10} {:>12} {:>12}".format(
+        "case", "calls", "calls/KB", "usec/KB"))
+    for name, text, oneln in cases:
+        scr = FakeScreen(args.rows, args.cols)
+        ui = ina.UiComponent(scr)
+        ui.oneln_mode = oneln
+        scr.move(5, 0)
+        scr.reset_counts()
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            ui.write(text)
+        elapsed = time.perf_counter() - start
+        kb = len(text) * args.repeat / 1024
+        calls = scr.total_calls()
+        print("{:<26} {:>10} {:>12.1f} {:>12.1f}".format(
+            name, calls // args.repeat, calls / kb, elapsed * 1e6 / kb))
+
+class HeadlessAppender(ina.IdioticNanowrimoAppender):
+    def load(self, stdscr):
+        super().load(stdscr)
+        self.ui.input = stdscr.feed
+
+
+def typed(text):
+    return [("keys", [c]) for c in text]
+
+
+def trace_typing(keys):
+    return typed(sample_text(keys))
+
+
+def trace_paste(keys):
+    events = []
+    while sum(len(e[1]) for e in events) < keys:
+        events.extend(typed(sample_text(200)))
+        events.append(("paste", sample_text(4 * 1024)))
+    return events
+
+
+def trace_resize(keys):
+    events = []
+    sizes = [(40, 120), (20, 60), (24, 80)]
+    for i, event in enumerate(trace_typing(keys)):
+        if i % 250 == 249:
+            events.append(("resize",) + sizes[i // 250 % len(sizes)])
+        events.append(event)
+    return events
+
+
+def trace_contest(keys):
+    third = keys // 3
+    events = [("keys", [ina.CTRL_W]), ("line", "30")]
+    events.extend(trace_typing(third))
+    events.extend([("keys", [ina.CTRL_R]), ("line", "25")])
+    events.extend(trace_typing(third))
+    events.append(("keys", [ina.CTRL_T]))
+    events.extend(trace_typing(third))
+    return events
+
+
+def trace_backspace(keys):
+    events = []
+    for i, event in enumerate(trace_typing(keys)):
+        events.append(event)
+        if i % 40 == 39:
+            events.append(("keys", [ina.CTRL_H]))
+    return events
+
+
+def trace_oneline(keys):
+    return [("keys", [ina.CTRL_B])] + trace_typing(keys)
+
+
+def trace_chapters(keys):
+    events = []
+    for i, event in enumerate(trace_typing(keys)):
+        if i % 500 == 499:
+            key = curses.KEY_NPAGE if i // 500 % 2 == 0 else curses.KEY_PPAGE
+            events.append(("keys", [key]))
+        events.append(event)
+    return events
+
+
+TRACES = {
+    "typing": trace_typing,
+    "paste": trace_paste,
+    "resize": trace_resize,
+    "contest": trace_contest,
+    "backspace": trace_backspace,
+    "oneline": trace_oneline,
+    "chapters": trace_chapters,
+}
+
+
+def parse_size(text):
+    units = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30}
+    text = text.strip().lower().rstrip("b")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def human_size(size):
+    for unit in ("", "K", "M", "G"):
+        if size < 1024 or unit == "G":
+            return "{:g}{}".format(size, unit)
+        size /= 1024
+
+
+def make_book(path, size):
+    chunk = sample_text(min(size, 1 << 20))
+    with open(path, "w") as f:
+        left = size
+        while left > 0:
+            f.write(chunk[:left])
+            left -= len(chunk)
+
+
+def replay(events, book, home, args, memory=False):
+    tmp = Path(home).parent
+    target = tmp / "chapter01.txt"
+    shutil.copyfile(str(book), str(target))
+    for path in tmp.glob("chapter*.txt"):
+        if path != target:
+            path.unlink()
+    (Path(home) / "settings.conf").write_text(
+        "[general]\ntruncate-enabled: true\ndurability: {}\n".format(
+            args.durability))
+    feed = KeyFeed(events)
+    scr = FakeScreen(args.rows, args.cols, feed)
+    opened = []
+
+    class CountingOutput(ina.DurableOutput):
+        def __init__(self, *a, **kw):
+            super().__init__(*a, **kw)
+            opened.append(self)
+
+    saved = ina.curses, ina.DurableOutput
+    ina.curses, ina.DurableOutput = fake_curses(scr), CountingOutput
+    out = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+            if memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            app = HeadlessAppender(["--user-config", str(home), str(target)])
+            app.loop(scr)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if memory else None
+    finally:
+        if memory:
+            tracemalloc.stop()
+        ina.curses, ina.DurableOutput = saved
+        feed.finish()
+        feed.close()
+    if not feed.ended:
+        raise RuntimeError("ina exited before the trace was finished")
+    lat = sorted(feed.latencies)
+    busy = sum(lat)
+    return {
+        "keys": feed.keys,
+        "elapsed": elapsed,
+        "keys_per_sec": feed.keys / busy if busy else 0,
+        "p50": lat[len(lat) // 2] if lat else 0,
+        "p99": lat[min(len(lat) - 1, len(lat) * 99 // 100)] if lat else 0,
+        "calls_per_key": scr.total_calls() / max(1, feed.keys),
+        "words": app.new_words,
+        "flushes": sum(o.flushes for o in opened),
+        "fsyncs": sum(o.fsyncs for o in opened),
+        "peak": peak,
+    }
+
+
+def load_trace(path):
+    with open(path) as f:
+        return [tuple(event) for event in json.load(f)]
+
+
+def bench_replay(args):
+    if args.trace_file:
+        traces = {Path(args.trace_file).stem: load_trace(args.trace_file)}
+    else:
+        names = args.traces.split(",") if args.traces else list(TRACES)
+        traces = {name: TRACES[name](args.keys) for name in names}
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    print("{:>6} {:<10} {:>6} {:>9} {:>8} {:>8} {:>9} {:>10} {:>10} {:>9}".format(
+        "size", "trace", "keys", "keys/s", "p50 us", "p99 us", "calls/key",
+        "flush/word", "fsync/word", "peak KB"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            book = Path(tmp) / "book.txt"
+            make_book(book, size)
+            work = Path(tmp) / "work"
+            home = work / "home"
+            home.mkdir(parents=True, exist_ok=True)
+            for name, events in traces.items():
+                result = replay(events, book, home, args)
+                peak = "-"
+                if args.memory:
+                    peak = "{:.0f}".format(replay(events, book, home, args,
+                                                  memory=True)["peak"] / 1024)
+                words = max(1, result["words"])
+                print("{:>6} {:<10} {:>6} {:>9.0f} {:>8.0f} {:>8.0f} {:>9.1f} "
+                      "{:>10.2f} {:>10.2f} {:>9}".format(
+                        human_size(size), name, result["keys"],
+                        result["keys_per_sec"], result["p50"] * 1e6,
+                        result["p99"] * 1e6, result["calls_per_key"],
+                        result["flushes"] / words, result["fsyncs"] / words,
+                        peak))
+                sys.stdout.flush()
+            book.unlink()
+
+
+def run_in_pty(args, script, rows=24, cols=80, ready=None):
+    # ready, if given, is called with the output so far and says when ina
+    # is up; otherwise it gets half a second.
+    import pty
+    import fcntl
+    import struct
+    import termios
+    pid, fd = pty.fork()
+    if pid == 0:
+        env = dict(os.environ, TERM=os.environ.get("TERM", "xterm"))
+        os.execvpe(sys.executable, [sys.executable, ina.__file__] + args, env)
+    fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack("HHHH", rows, cols, 0, 0))
+    out = bytearray()
+
+    def pump(seconds, until=None):
+        end = time.monotonic() + seconds
+        while True:
+            left = end - time.monotonic()
+            if left <= 0:
+                return
+            if select.select([fd], [], [], left)[0]:
+                try:
+                    out.extend(os.read(fd, 65536))
+                except OSError:
+                    return
+                if until is not None and until(out):
+                    return
+
+    if ready is None:
+        pump(0.5)
+    else:
+        pump(10, ready)
+    start = len(out)
+    for step in script:
+        if isinstance(step, (int, float)):
+            pump(step)
+        else:
+            os.write(fd, step)
+            pump(0.05)
+    emitted = len(out) - start
+    os.write(fd, b"\x18")
+    pump(0.5)
+    os.waitpid(pid, 0)
+    os.close(fd)
+    return emitted
+
+
+def bench_status(args):
+    script = [b"\x17", "{}\n".format(args.seconds // 60 + 2).encode()]
+    words = int(args.seconds * args.wpm / 60)
+    if words:
+        gap = args.seconds / words
+        script.extend(x for _ in range(words) for x in (b"word ", gap))
+    else:
+        script.append(args.seconds)
+    print("Characters handed to curses for {} status updates:".format(
+        args.seconds))
+    for diff in (True, False):
+        scr = FakeScreen(args.rows, args.cols)
+        ui = ina.UiComponent(scr)
+        ui.status_diff = diff
+        for second in range(args.seconds):
+            contest = ("war", args.seconds - second, second // 2,
+                       second / 2 / (second / 60 + 0.01))
+            ui.status_line(run_time=second, contests=[contest],
+                           total_words=1000 + second // 2,
+                           new_words=second // 2)
+        print("  status-diff {:<5} {:>8} chars {:>6} calls".format(
+            str(diff).lower(), scr.chars, scr.total_calls()))
+    print("Terminal bytes emitted by ina over {} seconds:".format(args.seconds))
+    print("{:<12} {:>12} {:>14}".format("status-diff", "bytes", "bytes/minute"))
+    for diff in ("true", "false"):
+        with tempfile.TemporaryDirectory() as tmp:
+            (Path(tmp) / "settings.conf").write_text(
+                "[general]\nstatus-diff: {}\n".format(diff))
+            target = str(Path(tmp) / "bench.txt")
+            emitted = run_in_pty(["--user-config", tmp, target], script,
+                                 args.rows, args.cols)
+        print("{:<12} {:>12} {:>14.0f}".format(
+            diff, emitted, emitted * 60 / args.seconds))
+
+
+def time_import():
+    code = ("import sys, time; sys.path.insert(0, {!r}); start = time.perf_counter(); "
+            "import ina; print(time.perf_counter() - start)").format(
+                str(Path(ina.__file__).parent))
+    out = subprocess.run([sys.executable, "-c", code], check=True,
+                         capture_output=True, text=True).stdout
+    return float(out)
+
+
+def time_first_paint(args, target, home):
+    painted = []
+    start = time.perf_counter()
+
+    def ready(out):
+        # The status line is drawn last in the first paint.
+        if b" words" in out:
+            painted.append(time.perf_counter() - start)
+            return True
+        return False
+
+    run_in_pty(["--user-config", home, target], [], ready=ready)
+    return painted[0] if painted else None
+
+
+def bench_startup(args):
+    imports = sorted(time_import() for _ in range(args.repeat))
+    with tempfile.TemporaryDirectory() as tmp:
+        target = str(Path(tmp) / "book.txt")
+        make_book(target, parse_size(args.size))
+        home = str(Path(tmp) / "home")
+        os.mkdir(home)
+        # The first run fills the word index and the settings cache, which
+        # is what every later start sees.
+        time_first_paint(args, target, home)
+        paints = sorted(time_first_paint(args, target, home) or float("inf")
+                        for _ in range(args.repeat))
+    median_import = imports[len(imports) // 2] * 1000
+    median_paint = paints[len(paints) // 2] * 1000
+    print("{:<28} {:>10.1f} ms".format("import ina", median_import))
+    print("{:<28} {:>10.1f} ms".format(
+        "launch to first paint ({})".format(args.size), median_paint))
+    print("{:<28} {:>10.1f} ms".format("budget", args.budget))
+    if median_paint > args.budget:
+        print("Over budget.")
+        return 1
+    return 0
+
+
+def bench_stream(args):
+    size = parse_size(args.size)
+    print("{:<12} {:>10} {:>10}".format("durability", "seconds", "MB/s"))
+    with tempfile.TemporaryDirectory() as tmp:
+        source = str(Path(tmp) / "source.txt")
+        make_book(source, size)
+        start = time.perf_counter()
+        shutil.copyfile(source, str(Path(tmp) / "copy.txt"))
+        took = time.perf_counter() - start
+        print("{:<12} {:>10.2f} {:>10.0f}".format("(cp)", took,
+                                                  size / took / (1 << 20)))
+        for durability in args.durability.split(","):
+            (Path(tmp) / "settings.conf").write_text(
+                "[general]\ndurability: {}\n".format(durability))
+            target = Path(tmp) / "target.txt"
+            if target.exists():
+                target.unlink()
+            with open(source, "rb") as f:
+                start = time.perf_counter()
+                subprocess.run([sys.executable, ina.__file__, "--user-config",
+                                tmp, "--stdin", str(target)], stdin=f,
+                               check=True, capture_output=True)
+                took = time.perf_counter() - start
+            print("{:<12} {:>10.2f} {:>10.0f}".format(
+                durability, took, size / took / (1 << 20)))
+    return 0
+
+
+async def war_client(address, name, wpm, stats):
+    import asyncio
+    reader, writer = await asyncio.open_unix_connection(address)
+    writer.write((json.dumps({"hello": name}) + "\n").encode())
+    contest = None
+    words = 0
+    sent = None
+    next_report = 0
+    while True:
+        try:
+            line = await asyncio.wait_for(reader.readline(), 0.1)
+        except asyncio.TimeoutError:
+            line = None
+        now = time.perf_counter()
+        if line == b"":
+            break
+        if line:
+            stats["bytes"] += len(line)
+            message = json.loads(line)
+            if "start" in message:
+                stats["starts"].append(now)
+                contest = message["start"]
+                begin = now + contest["in"]
+            elif "board" in message:
+                stats["boards"] += 1
+                if message["board"]["final"]:
+                    stats["finals"].append(now)
+                    break
+        if contest is not None and now >= begin:
+            # Words arrive as typing would make them; reports don't.
+            words = int((now - begin) * wpm / 60)
+            if now >= next_report and words != sent:
+                writer.write((json.dumps({"id": contest["id"],
+                                          "words": words}) + "\n").encode())
+                stats["reports"] += 1
+                sent = words
+                next_report = now + ina.WAR_REPORT_INTERVAL
+    writer.close()
+
+
+def bench_war(args):
+    import asyncio
+    import resource
+    with tempfile.TemporaryDirectory() as tmp:
+        address = str(Path(tmp) / "war.sock")
+        server = subprocess.Popen(
+            [sys.executable, ina.__file__, "--user-config", tmp,
+             "--serve", address], stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL)
+        while not os.path.exists(address):
+            time.sleep(0.05)
+        stats = {"bytes": 0, "boards": 0, "reports": 0, "starts": [],
+                 "finals": []}
+
+        async def run():
+            clients = [asyncio.ensure_future(war_client(
+                address, "writer{}".format(i), args.wpm, stats))
+                for i in range(args.clients)]
+            # Let everyone connect before the war is called.
+            await asyncio.sleep(1)
+            start = time.perf_counter()
+            server.stdin.write("war {}\n".format(args.seconds / 60).encode())
+            server.stdin.flush()
+            await asyncio.gather(*clients)
+            return start
+        called = asyncio.run(run())
+        server.stdin.write(b"quit\n")
+        server.stdin.close()
+        server.wait()
+    cpu = resource.getrusage(resource.RUSAGE_CHILDREN)
+    length = args.seconds + ina.WAR_COUNTDOWN + ina.WAR_GRACE
+    starts = sorted(stats["starts"])
+    print("{} clients, {} second war at {} WPM".format(
+        args.clients, args.seconds, args.wpm))
+    print("{:<34} {:>10.1f} ms".format(
+        "start spread", (starts[-1] - starts[0]) * 1000 if starts else 0))
+    print("{:<34} {:>10.1f} ms".format(
+        "call to last start", (starts[-1] - called) * 1000 if starts else 0))
+    print("{:<34} {:>10.2f}".format(
+        "reports per client per second",
+        stats["reports"] / args.clients / args.seconds))
+    print("{:<34} {:>10.2f}".format(
+        "boards per client per second",
+        stats["boards"] / args.clients / length))
+    print("{:<34} {:>10.0f}".format(
+        "bytes per client per second",
+        stats["bytes"] / args.clients / length))
+    print("{:<34} {:>10}".format(
+        "clients given the final board", len(stats["finals"])))
+    print("{:<34} {:>10.1f} %".format(
+        "server CPU", (cpu.ru_utime + cpu.ru_stime) / length * 100))
+    return 0
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks for ina.")
+    sub = parser.add_subparsers(dest="bench")
+    render = sub.add_parser("render",
+            help="Curses calls per rendered kilobyte in UiComponent.write.")
+    render.add_argument("--rows", type=int, default=24)
+    render.add_argument("--cols", type=int, default=80)
+    render.add_argument("--repeat", type=int, default=20)
+    render.set_defaults(func=bench_render)
+    status = sub.add_parser("status",
+            help="Terminal bytes emitted during a word war, with the "
+                 "status-diff setting on and off.")
+    status.add_argument("--seconds", type=int, default=60)
+    status.add_argument("--wpm", type=int, default=40,
+            help="Typing speed to simulate (0 for an idle contest).")
+    status.add_argument("--rows", type=int, default=24)
+    status.add_argument("--cols", type=int, default=80)
+    status.set_defaults(func=bench_status)
+    replay = sub.add_parser("replay",
+            help="Replay keystroke traces through a headless ina and report "
+                 "throughput, latency, curses calls, flushes and memory.")
+    replay.add_argument("--traces",
+            help="Comma separated synthetic traces to run ({}).".format(
+                ", ".join(TRACES)))
+    replay.add_argument("--trace-file",
+            help="Replay a recorded trace instead: a JSON list of events "
+                 "such as [\"keys\", [\"a\", 8]], [\"paste\", \"text\"], "
+                 "[\"line\", \"30\"], [\"resize\", 40, 120] or "
+                 "[\"wait\", 1.5].")
+    replay.add_argument("--keys", type=int, default=3000,
+            help="Approximate keystrokes in each synthetic trace.")
+    replay.add_argument("--sizes", default="0,64K,1M,10M,100M",
+            help="Sizes of the file being appended to.")
+    replay.add_argument("--durability", default=ina.DEFAULT_DURABILITY)
+    replay.add_argument("--no-memory", dest="memory", action="store_false",
+            help="Skip the second, tracemalloc instrumented, run.")
+    replay.add_argument("--rows", type=int, default=24)
+    replay.add_argument("--cols", type=int, default=80)
+    replay.set_defaults(func=bench_replay)
+    startup = sub.add_parser("startup",
+            help="Time importing ina and launching it to its first paint, "
+                 "and fail when the launch is over budget.")
+    startup.add_argument("--budget", type=float, default=STARTUP_BUDGET_MS,
+            help="Milliseconds allowed from launch to first paint.")
+    startup.add_argument("--size", default="10M",
+            help="Size of the file being opened.")
+    startup.add_argument("--repeat", type=int, default=9)
+    startup.set_defaults(func=bench_startup)
+    stream = sub.add_parser("stream",
+            help="Throughput of ina --stdin appending a large file, next to "
+                 "a plain copy.")
+    stream.add_argument("--size", default="100M")
+    stream.add_argument("--durability", default="word,batch,idle fsync",
+            help="Comma separated durability settings to try.")
+    stream.set_defaults(func=bench_stream)
+    war = sub.add_parser("war",
+            help="Load a local word war server with simulated clients and "
+                 "report the traffic and the server's CPU.")
+    war.add_argument("--clients", type=int, default=200)
+    war.add_argument("--seconds", type=int, default=20)
+    war.add_argument("--wpm", type=int, default=40)
+    war.set_defaults(func=bench_war)
+    args = parser.parse_args(argv)
+    if args.bench is None:
+        parser.print_help()
+        return 1
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -3,34 +3,54 @@
 import time
 import sys
 from pathlib import Path
-import io
 import os
 import re
-import glob
+import fnmatch
+import json
+import struct
+import threading
+import heapq
+import zlib
+from collections import deque
+from array import array
 
 import curses
 import select
-import argparse
-from configparser import ConfigParser
+import fcntl
 
 import locale
 locale.setlocale(locale.LC_ALL, '')
 code = locale.getpreferredencoding()
 
-parser = argparse.ArgumentParser(
-    description="This is an Idiotic NaNoWriMo Appender.")
-parser.add_argument("--user-config", metavar="DIR", 
-        help="Specify an alternate user configuration directory.")
-parser.add_argument("file", nargs='?', 
-                    help="Name of target file to append to.")
-parser.add_argument("--one-line", "-b", action='store_true',
-        help="Enable one-line mode from the start.")
-parser.add_argument("--generate-config", action='store_true',
-        help="Create a config file in ~/.config/ina/settings.conf")
-parser.add_argument('--version', action='version', version='ina Version 0.9.4')
-
-
-config = ConfigParser(inline_comment_prefixes=None)
+# Built on demand, so importing ina doesn't pay for argparse.
+def make_parser():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="This is an Idiotic NaNoWriMo Appender.")
+    parser.add_argument("--user-config", metavar="DIR", 
+            help="Specify an alternate user configuration directory.")
+    parser.add_argument("file", nargs='?', 
+                        help="Name of target file to append to.")
+    parser.add_argument("--one-line", "-b", action='store_true',
+            help="Enable one-line mode from the start.")
+    parser.add_argument("--generate-config", action='store_true',
+            help="Create a config file in ~/.config/ina/settings.conf")
+    parser.add_argument("--profile", action='store_true',
+            help="Time each stage of handling a key and print a summary on exit.")
+    parser.add_argument("--profile-trace", metavar="TRACE",
+            help="Profile, and also write a Chrome trace to TRACE.")
+    parser.add_argument("--stats", action='store_true',
+            help="Report words per day, week and month, best WPM and streaks.")
+    parser.add_argument("--stdin", action='store_true',
+            help="Append what is piped in to the file, without the screen,"
+                 " and report the words added.")
+    parser.add_argument("--serve", metavar="ADDRESS",
+            help="Run a word war server for a write-in on a socket path or"
+                 " [host]:port, instead of writing.")
+    parser.add_argument("--join", metavar="ADDRESS",
+            help="Take part in the word wars of the server at ADDRESS.")
+    parser.add_argument('--version', action='version', version='ina Version 0.9.4')
+    return parser
 
 
 DEFAULT_TAIL_COUNT = 280
@@ -38,6 +58,62 @@ DEFAULT_WRAP_MARGIN = "15"
 DEFAULT_POMODORO_TIME = "25" 
 DEFAULT_UNTITLED_FILENAME = "./%Y-%m-%d.txt"
 DEFAULT_TODO_MARKER = "TODO"
+DEFAULT_DURABILITY = "word"
+DEFAULT_NOTIFICATION = "flash"
+NOTIFICATION_MODES = ("flash", "bell", "osc", "none")
+SETTINGS_CACHE_VERSION = 3
+FLASH_TIME = 0.1
+DURABILITY_MODES = ("keystroke", "word", "batch", "idle")
+DEFAULT_BATCH_MS = 1000
+DEFAULT_BATCH_BYTES = 4096
+DEFAULT_IDLE_MS = 2000
+JOURNAL_RECORD = struct.Struct("<IIQ")
+JOURNAL_CHECKPOINT = 1 << 20
+WATCH_POLL_INTERVAL = 1.0
+IN_MODIFY = 0x2
+PROFILE_BUCKETS = 32
+TRACE_HEAD = b'{"traceEvents"'
+RATE_WINDOWS = (60, 300)
+RATE_BUCKETS = 12
+RATE_BAR = 30
+SPRINT_RECHECK = 60.0
+PROFILE_TRACE_LIMIT = 1000000
+TAIL_BLOCK_SIZE = 8192
+TAIL_READ_LIMIT = 1 << 20
+WORD_INDEX_VERSION = 3
+STATS_RECORD = struct.Struct("<IBdfif")
+STATS_KINDS = ("session", "war", "race", "pomodoro")
+STATS_INDEX_VERSION = 1
+WORD_INDEX_ENTRIES = 200
+WORD_INDEX_CHUNK = 1 << 16
+BACKGROUND_COUNT_SIZE = 1 << 20
+STREAM_CHUNK = 1 << 20
+STREAM_BACKLOG = 4 << 20
+STREAM_REPORT_INTERVAL = 5.0
+WAR_REPORT_INTERVAL = 2.0
+WAR_BOARD_INTERVAL = 1.0
+WAR_COUNTDOWN = 5.0
+WAR_GRACE = 3.0
+WAR_BOARD_TOP = 3
+WAR_NAME_LIMIT = 24
+WAR_BUFFER_LIMIT = 1 << 16
+WAR_BACKLOG = 1024
+TRUNCATE_WINDOW = 4096
+WRAP_POINT = re.compile("[ -]")
+NUMBER = re.compile("[0-9]+")
+VIEW_LINE_LIMIT = 1 << 16
+SCREEN_MODEL_FACTOR = 4
+OUTLINE_SEPARATORS = re.compile("[-_]")
+TAIL_TYPES = {
+    "word": "words", "words": "words",
+    "line": "lines", "lines": "lines",
+    "character": "chars", "characters": "chars",
+    "codepoint": "chars", "codepoints": "chars",
+    "byte": "chars", "bytes": "chars",
+    "char": "chars", "chars": "chars",
+    "para": "paras", "paras": "paras",
+    "paragraph": "paras", "paragraphs": "paras",
+}
 
 dist_config = '''
 [general]
@@ -126,6 +202,21 @@ dist_config = '''
 ## To make Pomodoro mode work like 'Word War'
 # pomodoro-during-run: words time rate
 
+## sprints
+##      Word wars that start by themselves at set times, for write-ins
+##      that sprint on the clock. Each one is a time and a length in
+##      minutes, separated by commas. A time like ':00' means every hour
+##      at that minute, one like '14:30' every day. They run alongside
+##      any other contest you have going.
+##
+## Twenty minutes on the hour, and ten on the half hour
+# sprints: :00 20, :30 10
+
+## war-name
+##      The name the others at a write-in see on the leaderboard, when you
+##      join a word war server with --join. Your login name by default.
+# war-name: NaNoFan
+
 ## todo-marker
 ##      When you accidentally hit TAB or an editing key,
 ##      it will insert a to-do marker ("TODO" by default). If you
@@ -145,6 +236,58 @@ dist_config = '''
 ##      the previous word is also useful. When truncation is enabled,
 ##      backspace will remove the previous word.
 # truncate-enabled: false
+
+## status-diff
+##      The status line is redrawn by writing only the parts of it that
+##      changed since the last update. This keeps the traffic down on
+##      serial consoles and slow remote links. Turn it off to always
+##      rewrite the whole line.
+# status-diff: true
+
+## profile
+##      Time every stage of handling a key (the key itself, contests, the
+##      status line, redraws, refreshes, writes and flushes) and print a
+##      summary when you exit with ^X. Give a file name instead of "on"
+##      to also write a trace that chrome://tracing or Perfetto can open.
+##      The same as the --profile and --profile-trace command-line flags.
+# profile: off
+
+## durability
+##      How eagerly your words are pushed to disk. The writing itself
+##      happens in the background, so typing never waits on the disk.
+##          keystroke : write after every key press
+##          word      : write after every word (the default)
+##          batch     : write every so often, or once enough has piled up
+##          idle      : write after every word, and fsync once you pause
+##      Add a number ending in 'ms' to set how often 'batch' writes or how
+##      long a pause 'idle' waits for, a number ending in 'b' to set how
+##      many bytes 'batch' may hold, and 'fsync' to also fsync the file
+##      after every write.
+##
+## The default
+# durability: word
+## Gentle on SD cards and network home directories
+# durability: batch 5000ms 16384b
+## Survive a power loss, not just a crash
+# durability: idle 2000ms
+
+## journal
+##      Everything you type is also appended to a small hidden journal
+##      file next to the target file as soon as you type it. If ina is
+##      killed before your words reached the target file, they are
+##      recovered from the journal the next time you open it. This is
+##      what makes the lazier durability settings safe to use.
+# journal: true
+
+## notification
+##      How ina tells you a contest is over, or that a key had nothing
+##      to do.
+##          flash : briefly reverse the screen (the default)
+##          bell  : ring the terminal bell
+##          osc   : send a desktop notification through the terminal
+##                  (OSC 9), and ring the bell for everything else
+##          none  : stay quiet
+# notification: flash
 '''
 
 
@@ -160,26 +303,86 @@ CTRL_L = ord("L") - ord("@")
 CTRL_P = ord("P") - ord("@")
 CTRL_B = ord("B") - ord("@")
 CTRL_QUESTION = 0x7f
+CTRL_ESC = 0x1b
+PASTE_START = [CTRL_ESC, "[", "2", "0", "0", "~"]
+PASTE_END = [CTRL_ESC, "[", "2", "0", "1", "~"]
+BURST_LIMIT = 4096
+DEADLINE_SLACK = 0.005
+STATUS_SPAN_GAP = 4
+# What ends a word, both while typing and when counting a file.
+WORD_SEPARATORS = "- \n\t\r\f\v"
+WORD_MARKS = bytes(0 if chr(c) in WORD_SEPARATORS else 1 for c in range(256))
+# What the keyboard would hand over as a key rather than as text.
+STREAM_CONTROLS = re.compile(rb"[\x00-\x09\x0b-\x1f\x7f]")
+# WORD_MARKS, with those keys marked 2 so they can be spotted in passing.
+STREAM_MARKS = bytes(2 if STREAM_CONTROLS.match(bytes([c])) else m
+                     for c, m in enumerate(WORD_MARKS))
+VIEW_NEXT_KEYS = (" ", "f", "j", "\n", curses.KEY_NPAGE, curses.KEY_DOWN)
+VIEW_BACK_KEYS = ("b", "k", curses.KEY_PPAGE, curses.KEY_UP)
+OUTLINE_KEYS = (393, 262, 402, 360)
+INTERACTIVE_KEYS = (CTRL_W, CTRL_R, CTRL_P) + OUTLINE_KEYS
 CONTEST_TITLES = {
     "war": "Word War",
     "race": "Word Race",
-    "pomodoro": "Pomodoro"
+    "pomodoro": "Pomodoro",
+    "sprint": "Sprint",
+}
+CONTEST_SHORT = {
+    "war": "War",
+    "race": "Race",
+    "pomodoro": "Pom",
+    "sprint": "Sprint",
 }
 
 class UiComponent:
     oneln_mode = False
+    notification = DEFAULT_NOTIFICATION
+    flash_until = None
+    status_diff = True
     wrap_margin = int(DEFAULT_WRAP_MARGIN)
     _last_max_x = -1
     _last_max_y = -1
     def __init__(self, stdscr):
         self.stdscr = stdscr 
+        # Anything select() can wait on; a benchmark feeds keys through a pipe.
+        self.input = sys.stdin
         self.need_reset = True
-
-    def reset(self):
+        self.status_dirty = True
+        self._status_cells = None
+        self.in_paste = False
+        self._held_keys = []
+        # Keys handed back to curses with unget, or left there by a burst
+        # cut short. select() can't see them, so they're looked for first.
+        self._ungot = False
+        # Everything written to the text area since the last reset, so the
+        # screen can be rebuilt without the file or reading it back.
+        self.model = deque()
+        self.model_len = 0
+        # Background work hands results to the main loop through _posted,
+        # and writes to the wake pipe so a waiting getch() notices.
+        self._posted = deque()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+
+    def reset(self, keep_model=False):
         self.need_reset = False
+        if not keep_model:
+            self.model.clear()
+            self.model_len = 0
         self.stdscr.clear()
         self.stdscr.scrollok(1)
-        max_y = self.stdscr.getmaxyx()[0]
+        self.invalidate_status()
+        max_y, max_x = self.stdscr.getmaxyx()
+        # The layout now matches this size, so status_line() has no reason
+        # to ask for another redraw.
+        self._last_max_y, self._last_max_x = max_y, max_x
+        # Keep the status line (and the blank line under it) out of the
+        # scrolling region so the text can't scroll it away.
+        if max_y > 5:
+            self.stdscr.setscrreg(2, max_y - 1)
+        elif max_y >= 3:
+            self.stdscr.setscrreg(1, max_y - 1)
         if max_y > 10:
             self.stdscr.move(5,0)
         elif max_y >= 3:
@@ -188,9 +391,10 @@ class UiComponent:
             self.stdscr.move(0,0)
         self.stdscr.refresh()
 
-    def status_line(self, *, run_time=None, contest_time=None,
-                    total_words=None, new_words = None, contest_words = None,
-                    contest_mode = None, contest_wpm = None,
+    def status_line(self, *, run_time=None, total_words=None,
+                    new_words = None, contests = (),
+                    project_words = None, session_wpm = None,
+                    contest_rate = None, board = None,
                     oneline = False):
         stdscr = self.stdscr
         global CONTEST_TITLES
@@ -221,6 +425,12 @@ class UiComponent:
             if new_words is not None:
                 b.append(str(new_words))
             left = "".join(b)
+        rate = ""
+        if session_wpm is not None and session_wpm[0] is not None:
+            if max_x >= 80 and session_wpm[1] is not None:
+                rate = " {}/{} WPM".format(*session_wpm)
+            elif max_x >= 40:
+                rate = " {} WPM".format(session_wpm[0])
         if self.oneln_mode:
             if max_x < 40:
                 left += " OL"
@@ -229,87 +439,109 @@ class UiComponent:
 
         if buf != "":
             buf += "  "
-        if contest_mode is not None and max_x >= 40:
-            title = CONTEST_TITLES.get(contest_mode, "Contest({})".format(contest_mode))
-            b = [title, " "]
+        if len(contests) == 1:
+            center = self._contest_text(contests[0], max_x, False)
+            if contest_rate is not None and max_x >= 80:
+                center += " ({} now)".format(contest_rate)
         else:
-            b = []
-        if contest_time is not None:
-            b.append(human_duration(contest_time))
-            if contest_words is not None:
-                b.append("/")
-        if contest_words is not None:
-            b.append(str(contest_words))
-        if contest_wpm is not None:
-            if isinstance(contest_wpm, float):
-                b.append(" {:.3f} WPM".format(contest_wpm))
-            else:
-                b.append(str(contest_wpm))
-        center = "".join(b)
+            # Several contests at once only get a short title and their
+            # clock and words each.
+            center = " | ".join(self._contest_text(contest, max_x, True)
+                                for contest in contests)
+        if board:
+            center = center + " | " + board if center else board
 
         if total_words is not None:
             if max_x < 40:
                 right = "{}w".format(total_words)
+            elif project_words is not None:
+                right = "{}/{} words".format(total_words, project_words)
             else:
                 right = "{} words".format(total_words)
 
-        stdscr.move(0, 0)
-        stdscr.clrtoeol()
         ce = len(center)
         ri = len(right)
         le = len(left)
+        # The rolling rate is the first thing to go when space runs out.
+        if rate and (le + len(rate) + ce + ri + 2 + 2 < max_x if center
+                     else le + len(rate) + ri + 1 < max_x):
+            left += rate
+            le = len(left)
         if center and ce + ri + le + 2+ 2  >= max_x:
             if max_x < 6:
-                pass
+                row = ""
             elif ce >= max_x:
-                stdscr.addstr(0, 0, "...")
-                stdscr.addstr(center[ce - max_x - 3:])
+                row = "..." + center[ce - max_x + 3:]
             else:
-                stdscr.addstr(0, 0, center) 
+                row = center
         elif center:
             space = (max_x - ce - ri - le) // 2;
-            stdscr.addstr(0, 0, left)
-            stdscr.addstr(" " * space)
-            stdscr.addstr(center)
-            stdscr.addstr(" " * space)
-            stdscr.addstr(right)
+            row = left + " " * space + center + " " * space + right
         elif ri + le + 1 >= max_x:
-            if le < max_x:
-                stdscr.addstr(0, 0, left) 
+            row = left if le < max_x else ""
         else:
             space = (max_x - ri - le);
-            stdscr.addstr(0, 0, left)
-            stdscr.addstr(" " * space)
-            stdscr.addstr(right)
+            row = left + " " * space + right
+        row = row[:max_x].ljust(max_x)
 
-        if max_y > 5:
-            stdscr.move(1,0)
+        old = self._status_cells
+        if not self.status_diff or old is None or len(old) != max_x:
+            stdscr.move(0, 0)
             stdscr.clrtoeol()
+            stdscr.addstr(0, 0, row.rstrip())
+            if max_y > 5:
+                stdscr.move(1,0)
+                stdscr.clrtoeol()
+        else:
+            for start, end in _changed_spans(old, row):
+                stdscr.addstr(0, start, row[start:end])
+        self._status_cells = row
         stdscr.move(y,x)
+        self.status_dirty = False
+
+    @staticmethod
+    def _contest_text(contest, max_x, compact):
+        contest_mode, contest_time, contest_words, contest_wpm = contest
+        titles = CONTEST_SHORT if compact else CONTEST_TITLES
+        if contest_mode is not None and max_x >= 40:
+            title = titles.get(contest_mode, "Contest({})".format(contest_mode))
+            b = [title, " "]
+        else:
+            b = []
+        if contest_time is not None:
+            b.append(human_duration(contest_time))
+            if contest_words is not None:
+                b.append("/")
+        if contest_words is not None:
+            b.append(str(contest_words))
+        if contest_wpm is not None and not (compact and contest_words is not None):
+            if compact:
+                b.append(" {:.0f} WPM".format(contest_wpm))
+            elif isinstance(contest_wpm, float):
+                b.append(" {:.3f} WPM".format(contest_wpm))
+            else:
+                b.append(str(contest_wpm))
+        return "".join(b)
+
+    def invalidate_status(self):
+        self._status_cells = None
+        self.status_dirty = True
 
     def _query_narrow(self, question):
         global code
-        cur_y, cur_x = self.stdscr.getyx()
-        max_y, max_x = self.stdscr.getmaxyx()
-
-        buf = [] 
-        for y in range(max_y):
-            buf.append(self.stdscr.instr(y, 0))
+        cur_y = self.stdscr.getyx()[0]
 
         self.stdscr.clear() 
         self.stdscr.move(cur_y,0)
-        self.write(question)
-        self.write(" ")
+        self.write(question, record=False)
+        self.write(" ", record=False)
         cy, cx = self.stdscr.getyx()
         curses.echo()
         resp = self.stdscr.getstr(cy, cx)
         got = str(resp, code)
         curses.noecho() 
 
-        self.stdscr.clear()
-        for y in range(max_y):
-            self.stdscr.insstr(y, 0, buf[y])
-        self.stdscr.move(cur_y, cur_x)
+        self.redraw()
         self.stdscr.refresh()
 
         return got
@@ -317,7 +549,6 @@ class UiComponent:
     def _query_small(self, question):
         global code
         cur_y, cur_x = self.stdscr.getyx()
-        buf = self.stdscr.instr(0, 0)
         self.stdscr.addstr(0,0, question)
         self.stdscr.clrtoeol() 
         curses.echo()
@@ -326,7 +557,7 @@ class UiComponent:
         curses.noecho() 
         self.stdscr.move(0,0)
         self.stdscr.clrtoeol()
-        self.stdscr.insstr(0, 0, buf) 
+        self.invalidate_status()
         self.stdscr.move(cur_y, cur_x)
         return got
 
@@ -356,58 +587,123 @@ class UiComponent:
         outf.write(what)
         self.write(what)
 
+    def notify(self, message=None):
+        if self.notification == "bell" or (self.notification == "osc"
+                                           and message is None):
+            curses.beep()
+        elif self.notification == "osc":
+            sys.stdout.write("\x1b]9;{}\x07".format(message))
+            sys.stdout.flush()
+        elif self.notification != "none":
+            self.flash()
+
     def flash(self):
-        stdscr = self.stdscr
         # curses.flash() exists, but didn't work in iTerm2 on the Mac for me.
+        # The screen is put back by end_effects(), so input keeps flowing
+        # while it is reversed.
+        self._set_attr(curses.A_REVERSE)
+        self.flash_until = time.perf_counter() + FLASH_TIME
+
+    def _set_attr(self, attr):
+        stdscr = self.stdscr
         cur_y, cur_x = self.stdscr.getyx()
         max_y = self.stdscr.getmaxyx()[0]
         for y in range(max_y):
-            stdscr.chgat(y, 0, curses.A_REVERSE)
-        stdscr.refresh()
-        time.sleep(0.1)
-        for y in range(max_y):
-            stdscr.chgat(y, 0, curses.A_NORMAL)
-        stdscr.refresh()
+            stdscr.chgat(y, 0, attr)
         stdscr.move(cur_y, cur_x)
 
-    def write(self, data):
+    def effect_deadline(self):
+        if self.flash_until is None:
+            return None
+        return self.flash_until - time.perf_counter()
+
+    def end_effects(self):
+        if self.flash_until is not None and time.perf_counter() >= self.flash_until:
+            self.flash_until = None
+            self._set_attr(curses.A_NORMAL)
+
+    def write(self, data, record=True):
         global code
+        if not isinstance(data, str):
+            data = str(data, code)
+        if record:
+            self._record(data)
+        self._render(data)
+
+    def _record(self, data):
+        self.model.append(data)
+        self.model_len += len(data)
+        max_y, max_x = self.stdscr.getmaxyx()
+        cap = max_y * max_x * SCREEN_MODEL_FACTOR
+        while self.model_len - len(self.model[0]) >= cap:
+            self.model_len -= len(self.model.popleft())
+        if self.model_len > cap:
+            self.model[0] = self.model[0][self.model_len - cap:]
+            self.model_len = cap
+
+    def _render(self, data):
         stdscr = self.stdscr
-        cur_y = stdscr.getyx()[0]
-        if isinstance(data, str):
-            max_y, max_x = self.stdscr.getmaxyx()
-            cur_y, cur_x = self.stdscr.getyx()
-            limit = int(max_x * self.wrap_margin / 100)
-            limit = max_x - limit
-            for d in data:
-                if self.oneln_mode and max_y >= 3:
-                    stdscr.addstr(cur_y - 1, cur_x, " " * len(d))
-                    stdscr.move(cur_y, cur_x)
-                if d in " -" and cur_x >= limit:
-                    if self.oneln_mode and max_y >= 3:
-                        stdscr.move(cur_y - 1, 0)
-                        stdscr.clrtoeol()
-                        stdscr.move(cur_y, cur_x)
-                    stdscr.addstr(d)
-                    stdscr.addstr("\n")
-                elif d in "\n":
-                    if self.oneln_mode and max_y >= 3:
-                        stdscr.move(cur_y - 1, 0)
-                        stdscr.clrtoeol()
-                        stdscr.move(cur_y, cur_x)
-                    stdscr.addstr(d)
+        max_y, max_x = stdscr.getmaxyx()
+        cur_y, cur_x = stdscr.getyx()
+        limit = int(max_x * self.wrap_margin / 100)
+        limit = max_x - limit
+        oneln = self.oneln_mode and max_y >= 3 and cur_y > 0
+        pos = 0
+        end = len(data)
+        while pos < end:
+            # A run ends at a newline, at the first space or dash typed in
+            # the wrap margin, or where curses itself wraps at the edge.
+            stop = data.find("\n", pos)
+            if stop < 0:
+                stop = end
+            edge = pos + max_x - cur_x
+            m = None
+            if cur_x + stop - pos > limit:
+                m = WRAP_POINT.search(data, pos + max(0, limit - cur_x),
+                                      min(stop, edge))
+            if m is not None:
+                run = data[pos:m.end()] + "\n"
+                pos = m.end()
+            elif stop < end and stop < edge:
+                run = data[pos:stop + 1]
+                pos = stop + 1
+            else:
+                run = data[pos:min(stop, edge)]
+                pos += len(run)
+            if oneln:
+                if run[-1] == "\n":
+                    stdscr.move(cur_y - 1, 0)
+                    stdscr.clrtoeol()
                 else:
-                    stdscr.addstr(d)
-        else:
-            for d in data:
-                write(stdscr, d)
+                    stdscr.addstr(cur_y - 1, cur_x, " " * len(run))
+                stdscr.move(cur_y, cur_x)
+            stdscr.addstr(run)
+            newline = run[-1] == "\n"
+            cur_x += len(run) - newline
+            for wrapped in (cur_x >= max_x, newline):
+                if wrapped:
+                    cur_x = 0
+                    if cur_y < max_y - 1:
+                        cur_y += 1
+                    oneln = self.oneln_mode and max_y >= 3
 
     def getch(self, block=True, timeout=None):
         stdscr = self.stdscr
         stdscr.refresh()
+        if timeout and self._ungot:
+            self._ungot = False
+            stdscr.nodelay(1)
+            try:
+                return self._key(stdscr.get_wch())
+            except curses.error:
+                pass
+            finally:
+                stdscr.nodelay(0)
         if timeout:
-            check = select.select([sys.stdin], [], [], timeout)[0]
-            if len(check) == 0:
+            check = select.select([self.input, self._wake_r], [], [], timeout)[0]
+            if self._wake_r in check:
+                self._drain_wake()
+            if self.input not in check:
                 return None
             ret = stdscr.get_wch()
         elif block:
@@ -422,44 +718,1406 @@ class UiComponent:
                 ret = None
             finally:
                 stdscr.nodelay(0)
+        return self._key(ret)
+
+    def _key(self, ret):
         if isinstance(ret, str) and len(ret) == 1 and (ord(ret) < 0x20 or ord(ret) == 0x7f):
             if ret not in "\t\n":
                 ret = ord(ret)
         return ret
 
-    def pause(self):
+    def getkeys(self, timeout=None):
+        stdscr = self.stdscr
+        keys = self._held_keys
+        self._held_keys = []
+        if keys:
+            stdscr.refresh()
+        else:
+            key = self.getch(timeout=timeout)
+            if key is None:
+                return keys
+            keys.append(key)
+        stdscr.nodelay(1)
+        try:
+            while len(keys) < BURST_LIMIT:
+                try:
+                    ret = stdscr.get_wch()
+                except curses.error:
+                    break
+                keys.append(self._key(ret))
+            else:
+                self._ungot = True
+        finally:
+            stdscr.nodelay(0)
+        return self._unbracket(keys, hold=len(keys) < BURST_LIMIT)
+
+    def _unbracket(self, keys, hold):
+        ret = []
+        i = 0
+        while i < len(keys):
+            key = keys[i]
+            if key == CTRL_ESC:
+                marker = keys[i:i + len(PASTE_START)]
+                if marker == PASTE_START or marker == PASTE_END:
+                    self.in_paste = marker == PASTE_START
+                    i += len(marker)
+                    continue
+                if (hold and 1 < len(marker) < len(PASTE_START) and marker in
+                        (PASTE_START[:len(marker)], PASTE_END[:len(marker)])):
+                    # The rest of the marker hasn't arrived yet.
+                    self._held_keys = marker
+                    break
+            elif key == 13 and self.in_paste:
+                key = "\n"
+            ret.append(key)
+            i += 1
+        return ret
+
+    def post(self, callback):
+        self._posted.append(callback)
+        try:
+            os.write(self._wake_w, b"x")
+        except BlockingIOError:
+            pass
+
+    def run_posted(self):
+        while self._posted:
+            self._posted.popleft()()
+
+    def _drain_wake(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def unget(self, keys):
+        self._ungot = True
+        for key in reversed(keys):
+            try:
+                if isinstance(key, str):
+                    curses.unget_wch(key)
+                else:
+                    curses.ungetch(key)
+            except curses.error:
+                break
+
+    def bracketed_paste(self, enable):
+        sys.stdout.write("\x1b[?2004h" if enable else "\x1b[?2004l")
+        sys.stdout.flush()
+
+    def pause(self, histogram=None):
         stdscr = self.stdscr
-        cur_y, cur_x = self.stdscr.getyx()
         max_y, max_x = self.stdscr.getmaxyx()
-        buf = []
-        for y in range(max_y):
-            buf.append(stdscr.instr(y, 0))
         stdscr.clear()
         msg = "Paused."
-        stdscr.addstr(max_y // 2, max_x // 2 - len(msg) // 2, msg)
+        lines = []
+        if histogram is not None and any(map(any, histogram)):
+            lines = rate_histogram(*histogram, width=max_x)
+        if len(lines) + 2 > max_y:
+            lines = []
+        top = max(0, (max_y - len(lines) - 2) // 2)
+        stdscr.addstr(top, max(0, max_x // 2 - len(msg) // 2), msg[:max_x])
+        left = max(0, (max_x - max(map(len, lines), default=0)) // 2)
+        for i, line in enumerate(lines):
+            stdscr.addstr(top + 2 + i, left, line[:max_x - left])
         self.getch(stdscr)
-        stdscr.clear()
-        for y in range(max_y):
-            stdscr.insstr(y, 0, buf[y])
-        stdscr.move(cur_y, cur_x)
+        self.redraw()
         stdscr.refresh()
 
+    def redraw(self):
+        self.reset(keep_model=True)
+        oneln = self.oneln_mode
+        self.oneln_mode = False
+        self._render("".join(self.model))
+        self.oneln_mode = oneln
+        if oneln:
+            self._hide_above()
+
+    def view_file(self, path):
+        max_y, max_x = self.stdscr.getmaxyx()
+        with open(path, errors="replace") as f:
+            # Each page is remembered by where it starts: the file position
+            # of a line and how many wrapped rows of that line came before.
+            pages = [(f.tell(), 0)]
+            page = 0
+            win = None
+            while True:
+                rows = max(1, max_y - 2) if max_y >= 3 else max_y
+                lines, more = self._view_page(f, pages[page], rows, max_x)
+                if win is None:
+                    if not more and all(not l.strip() for l in lines):
+                        return False
+                    win = curses.newwin(max_y, max_x, 0, 0)
+                    win.keypad(1)
+                if more is not None and page + 1 == len(pages):
+                    pages.append(more)
+                win.erase()
+                top = 1 if max_y >= 3 else 0
+                if top:
+                    title = "<<{}>> page {}".format(path, page + 1)
+                    win.addnstr(0, 0, title, max_x - 1, curses.A_REVERSE)
+                    hint = "Space: next  b: back  q: close"
+                    if len(hint) < max_x:
+                        win.addnstr(max_y - 1, 0, hint, max_x - 1)
+                for y, line in enumerate(lines):
+                    win.addnstr(top + y, 0, line, max_x - 1)
+                win.refresh()
+                key = self._key(win.get_wch())
+                if key in VIEW_NEXT_KEYS:
+                    if more is not None:
+                        page += 1
+                elif key in VIEW_BACK_KEYS:
+                    if page > 0:
+                        page -= 1
+                elif key in ("g", curses.KEY_HOME):
+                    page = 0
+                elif key == curses.KEY_RESIZE:
+                    max_y, max_x = self.stdscr.getmaxyx()
+                    del pages[page + 1:]
+                    pages[page] = (pages[page][0], 0)
+                    win.resize(max_y, max_x)
+                else:
+                    break
+        del win
+        self.stdscr.touchwin()
+        self.stdscr.refresh()
+        return True
+
+    def _view_page(self, f, start, rows, width):
+        import textwrap
+        pos, skip = start
+        f.seek(pos)
+        lines = []
+        while True:
+            pos = f.tell()
+            line = f.readline(VIEW_LINE_LIMIT)
+            if not line:
+                return lines, None
+            wrapped = textwrap.wrap(line.rstrip("\n"), max(1, width - 1)) or [""]
+            wrapped = wrapped[skip:]
+            room = rows - len(lines)
+            if len(wrapped) > room:
+                lines.extend(wrapped[:room])
+                return lines, (pos, skip + room)
+            lines.extend(wrapped)
+            skip = 0
+            if len(lines) == rows:
+                next_pos = f.tell()
+                if not f.read(1):
+                    return lines, None
+                return lines, (next_pos, 0)
+
+    def unwrite(self, count):
+        removed = []
+        left = count
+        while left > 0 and self.model:
+            last = self.model.pop()
+            if len(last) > left:
+                self.model.append(last[:-left])
+                last = last[-left:]
+            removed.append(last)
+            left -= len(last)
+        self.model_len -= count - left
+        cur_y, cur_x = self.stdscr.getyx()
+        if count > cur_x or any("\n" in r for r in removed):
+            self.redraw()
+            return
+        self.stdscr.move(cur_y, cur_x - count)
+        self.stdscr.clrtoeol()
+
+    def _hide_above(self):
+        cur_y, cur_x = self.stdscr.getyx()
+        if cur_y < 1:
+            return
+        for y in range(1,cur_y - 1):
+            self.stdscr.move(y, 0)
+            self.stdscr.clrtoeol()
+        self.stdscr.addstr(cur_y - 1, 0, " " * cur_x)
+        self.stdscr.move(cur_y, cur_x)
+
     def toggle_oneline(self, new_state = None):
         if new_state is None:
             new_state = not self.oneln_mode
         if new_state:
-            max_y = self.stdscr.getmaxyx()[0]
-            cur_y, cur_x = self.stdscr.getyx()
-            for y in range(1,cur_y - 1):
-                self.stdscr.move(y, 0)
-                self.stdscr.clrtoeol()
-            self.stdscr.addstr(cur_y - 1, 0, " " * cur_x)
-            self.stdscr.move(cur_y, cur_x)
+            self._hide_above()
+        elif self.oneln_mode:
+            self.oneln_mode = False
+            self.redraw()
         self.oneln_mode = new_state
         return new_state
 
 
 
+class DurableOutput:
+    def __init__(self, filename, durability=DEFAULT_DURABILITY, journal=True):
+        self.mode, self.interval, self.max_bytes, self.fsync = parse_durability(durability)
+        self.file = open(filename, "ab")
+        self.closed = False
+        self._size = os.fstat(self.file.fileno()).st_size
+        # What the file held after our last write. Anything past it that we
+        # didn't write was appended by someone else.
+        self._flushed = self._size
+        self._foreign = []
+        # Backspace may only cut back to here: text after someone else's
+        # append is ours, text before it is theirs. Until then it's only
+        # what was there already, which truncate-enabled has always let
+        # backspace take words from.
+        self.own_from = 0
+        self._stale_journal = False
+        self._journal_path = None
+        self._journal = None
+        self._journal_bytes = 0
+        if journal:
+            # One journal per process, locked for as long as it's in use, so
+            # a second ina on the same file can tell it isn't abandoned.
+            self._journal_path = journal_path(filename, os.getpid())
+            self._journal = os.open(str(self._journal_path),
+                    os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_TRUNC, 0o600)
+            fcntl.flock(self._journal, fcntl.LOCK_EX)
+        self.flushes = 0
+        self.fsyncs = 0
+        # The input path only ever holds _cond, and only briefly. Disk I/O
+        # happens under _io_lock, taken before _cond so batches stay in order.
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._pending = []
+        self._pending_bytes = 0
+        self._first_pending = None
+        self._last_write = time.monotonic()
+        self._want_flush = False
+        self._unsynced = False
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def write(self, text):
+        global code
+        self.append(text.encode(code, errors="replace"))
+
+    def append(self, data):
+        with self._cond:
+            if self._journal is not None:
+                record = _journal_record(self._size, data)
+                os.write(self._journal, record)
+                self._journal_bytes += len(record)
+            self._size += len(data)
+            if not self._pending:
+                self._first_pending = time.monotonic()
+            self._pending.append(data)
+            self._pending_bytes += len(data)
+            self._last_write = time.monotonic()
+            if self.mode == "keystroke" or (self.mode == "batch"
+                    and self._pending_bytes >= self.max_bytes):
+                self._want_flush = True
+            self._cond.notify()
+
+    def backlog(self):
+        with self._cond:
+            return self._pending_bytes
+
+    def size(self):
+        with self._cond:
+            return self._size
+
+    def end_word(self):
+        if self.mode in ("word", "idle"):
+            with self._cond:
+                self._want_flush = True
+                self._cond.notify()
+
+    def flush(self):
+        with self._io_lock:
+            self._drain()
+
+    def truncate(self, size):
+        with self._io_lock:
+            self._drain()
+            fd = self.file.fileno()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size != self._flushed:
+                    return False
+                with self._cond:
+                    self._checkpoint()
+                    os.ftruncate(fd, size)
+                    self._size = size
+                    self._flushed = size
+                    self.own_from = min(self.own_from, size)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        return True
+
+    def check_foreign(self):
+        # Only looks; what's pending is left for the flusher unless someone
+        # else's append means it has to go out now. Our own flushes wake the
+        # watcher too, so the size is compared first without _io_lock: the
+        # flusher holds it through fsync, and the input path mustn't wait.
+        if os.fstat(self.file.fileno()).st_size == self._flushed:
+            return
+        with self._io_lock:
+            self._write([], check=True)
+
+    def take_foreign(self):
+        with self._cond:
+            found = self._foreign
+            self._foreign = []
+        return found
+
+    def close(self):
+        if self.closed:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join()
+        with self._io_lock:
+            self._drain()
+            if self._unsynced:
+                self._sync()
+            self.file.close()
+            if self._journal is not None:
+                os.close(self._journal)
+                self._journal_path.unlink()
+        self.closed = True
+
+    def _drain(self):
+        with self._cond:
+            batch = self._pending
+            self._pending = []
+            self._pending_bytes = 0
+            self._want_flush = False
+        self._write(batch)
+
+    def _write(self, batch, check=False):
+        if batch or check:
+            # Another ina, or a sync tool, may be appending to the same
+            # file. The lock keeps each batch in one piece.
+            fd = self.file.fileno()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                size = os.fstat(fd).st_size
+                if size != self._flushed:
+                    batch = self._rebase(size, batch)
+                if batch:
+                    data = b"".join(batch)
+                    self.file.write(data)
+                    self.file.flush()
+                    self._flushed = size + len(data)
+                    self.flushes += 1
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        if batch:
+            if self.fsync:
+                self._sync()
+            else:
+                self._unsynced = True
+        if self._journal_bytes >= JOURNAL_CHECKPOINT or self._stale_journal:
+            with self._cond:
+                if not self._pending:
+                    self._checkpoint()
+                    self._stale_journal = False
+
+    def _rebase(self, size, batch):
+        with self._cond:
+            if size > self._flushed:
+                self._foreign.append((self._flushed, size))
+                self.own_from = size
+            self._size += size - self._flushed
+            self._flushed = size
+            # Everything journaled so far has the old offsets, so write it
+            # all now and start the journal over once it's on disk.
+            batch = batch + self._pending
+            self._pending = []
+            self._pending_bytes = 0
+            self._want_flush = False
+            self._stale_journal = True
+        return batch
+
+    def _checkpoint(self):
+        # Everything journaled so far has reached the target file.
+        if self._journal is not None:
+            os.ftruncate(self._journal, 0)
+            self._journal_bytes = 0
+
+    def _sync(self):
+        os.fsync(self.file.fileno())
+        self.fsyncs += 1
+        self._unsynced = False
+
+    def _next_wakeup(self):
+        now = time.monotonic()
+        if self.mode == "batch" and self._pending:
+            return max(0, self._first_pending + self.interval - now)
+        if self.mode == "idle" and (self._pending or self._unsynced):
+            return max(0, self._last_write + self.interval - now)
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not (self._want_flush or self._stopping):
+                    timeout = self._next_wakeup()
+                    if timeout == 0:
+                        break
+                    self._cond.wait(timeout)
+                if self._stopping:
+                    return
+                idle = (self.mode == "idle"
+                        and time.monotonic() - self._last_write >= self.interval)
+            with self._io_lock:
+                self._drain()
+                if idle and self._unsynced:
+                    self._sync()
+
+
+class FileWatcher:
+    def __init__(self, filename, callback):
+        self.filename = filename
+        self.callback = callback
+        self._stop_r, self._stop_w = os.pipe()
+        self._inotify = None
+        try:
+            self._inotify = _inotify_watch(filename)
+        except (OSError, AttributeError):
+            pass
+        target = self._watch if self._inotify is not None else self._poll
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        os.write(self._stop_w, b"x")
+        self._thread.join()
+        for fd in (self._stop_r, self._stop_w, self._inotify):
+            if fd is not None:
+                os.close(fd)
+
+    def _watch(self):
+        while True:
+            ready = select.select([self._inotify, self._stop_r], [], [])[0]
+            if self._stop_r in ready:
+                return
+            try:
+                while os.read(self._inotify, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+            self.callback()
+
+    def _poll(self):
+        last = None
+        while not select.select([self._stop_r], [], [], WATCH_POLL_INTERVAL)[0]:
+            try:
+                st = os.stat(self.filename)
+                seen = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                continue
+            if last is not None and seen != last:
+                self.callback()
+            last = seen
+
+
+class ProjectIndex:
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.files = {}
+        self._mtime = None
+
+    def refresh(self):
+        # Adding, removing or renaming a file changes the directory's
+        # mtime, so one stat tells us whether the listing is still good.
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            self.files = {}
+            self._mtime = None
+            return
+        if mtime == self._mtime:
+            return
+        files = {}
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith(".") or _is_backup(entry.name):
+                    continue
+                try:
+                    if entry.is_file():
+                        st = entry.stat()
+                        files[entry.name] = (st.st_size, st.st_mtime)
+                except OSError:
+                    continue
+        self.files = files
+        self._mtime = mtime
+
+    def chapters(self, name):
+        split = _split_number(name)
+        if split is None:
+            return None
+        prefix, _, rest = split
+        self.refresh()
+        found = []
+        for other in self.files:
+            got = _split_number(other)
+            if got is not None and got[0] == prefix and got[2] == rest:
+                found.append((int(got[1]), other))
+        found.sort()
+        return found
+
+    def neighbour(self, name, offset):
+        chapters = self.chapters(name)
+        if chapters is None:
+            return None
+        prefix, orig, rest = _split_number(name)
+        cur = int(orig)
+        if offset > 0:
+            later = [n for n in chapters if n[0] > cur]
+            if len(later) >= offset:
+                return later[offset - 1][1]
+            # Past the last chapter, start a new one right after it.
+            last = later[-1][0] if later else cur
+            newn = last + offset - len(later)
+        else:
+            earlier = [n for n in chapters if n[0] < cur]
+            if len(earlier) >= -offset:
+                return earlier[offset][1]
+            return ""
+        return prefix + str(newn).zfill(len(orig)) + rest
+
+    def outlines(self, name):
+        stem = Path(name).stem
+        c = OUTLINE_SEPARATORS.split(stem)
+        if len(c) == 1:
+            spec = stem.split(".")[0] + "*"
+        else:
+            spec = c[0] + "*" + Path(name).suffix
+        self.refresh()
+        return spec, sorted(n for n in self.files
+                            if n != name and fnmatch.fnmatchcase(n, spec))
+
+
+class WordCountIndex:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = None
+        # Chapters are counted from a worker pool, so the cache is shared.
+        self._lock = threading.Lock()
+
+    def _load(self):
+        self.entries = {}
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get("version") == WORD_INDEX_VERSION:
+            self.entries = data.get("files", {})
+
+    def _save(self):
+        if len(self.entries) > WORD_INDEX_ENTRIES:
+            keep = sorted(self.entries.items(), key=lambda e: e[1]["used"])
+            self.entries = dict(keep[-WORD_INDEX_ENTRIES:])
+        tmp = self.path.with_suffix(".new")
+        try:
+            tmp.write_text(json.dumps({"version": WORD_INDEX_VERSION,
+                                       "files": self.entries}))
+            tmp.replace(self.path)
+        except OSError:
+            pass
+
+    def _entry(self, key):
+        with self._lock:
+            if self.entries is None:
+                self._load()
+            return self.entries.get(key)
+
+    def _scan(self, filename, limit=None):
+        key = os.path.abspath(filename)
+        entry = self._entry(key)
+        with open(filename, "rb") as f:
+            st = os.fstat(f.fileno())
+            size, mtime = st.st_size, st.st_mtime
+            if limit is not None and limit < size:
+                # Only the part that was there when the file was opened;
+                # anything after it is being typed right now.
+                size, mtime = limit, None
+            # ina records what it appended itself when it's done (see
+            # remember). Any other change could be anywhere in the file, so
+            # only an untouched file is trusted and the rest is recounted.
+            if (entry is not None and entry["size"] == size
+                    and entry["mtime"] == mtime):
+                words, partial = entry["words"], entry["partial"]
+            else:
+                words, partial = _count_stream(f, 0, False, size)
+            entry = {
+                "size": size,
+                "mtime": mtime,
+                "words": words,
+                "partial": partial,
+                "used": time.time(),
+            }
+        return key, entry
+
+    def cached(self, filename):
+        entry = self._entry(os.path.abspath(filename))
+        if entry is None:
+            return None
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        if entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+            return entry["words"], entry["partial"]
+        return None
+
+    def remember(self, filename, size, words, partial):
+        # Called with what a session wrote, once it's on disk. Someone else
+        # appending since is caught by the size.
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return
+        if st.st_size != size:
+            return
+        self._store([(os.path.abspath(filename), {
+            "size": size,
+            "mtime": st.st_mtime,
+            "words": words,
+            "partial": partial,
+            "used": time.time(),
+        })])
+
+    def _store(self, found):
+        with self._lock:
+            if self.entries is None:
+                self._load()
+            self.entries.update(found)
+            self._save()
+
+    def count(self, filename, limit=None):
+        key, entry = self._scan(filename, limit)
+        self._store([(key, entry)])
+        return entry["words"], entry["partial"]
+
+    def count_all(self, filenames, workers=None):
+        from concurrent.futures import ThreadPoolExecutor
+        def scan(filename):
+            try:
+                return self._scan(filename)
+            except OSError:
+                return None
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            found = [got for got in pool.map(scan, filenames) if got]
+        if found:
+            self._store(found)
+        return [entry["words"] for _, entry in found]
+
+
+class StatsStore:
+    def __init__(self, directory):
+        self.path = Path(directory) / "stats.bin"
+        self.index_path = Path(directory) / "stats-index.json"
+        self.index = None
+
+    def _empty(self):
+        return {"version": STATS_INDEX_VERSION, "offset": 0, "days": {},
+                "best": {}}
+
+    def _load(self):
+        try:
+            index = json.loads(self.index_path.read_text())
+        except (OSError, ValueError):
+            index = None
+        if not isinstance(index, dict) or index.get("version") != STATS_INDEX_VERSION:
+            index = self._empty()
+        self.index = index
+
+    def _save(self):
+        tmp = self.index_path.with_suffix(".new")
+        try:
+            tmp.write_text(json.dumps(self.index))
+            tmp.replace(self.index_path)
+        except OSError:
+            pass
+
+    def _add_to_index(self, kind, start, duration, words, wpm):
+        day = time.strftime("%Y-%m-%d", time.localtime(start))
+        if kind == "session":
+            totals = self.index["days"].setdefault(day, [0, 0, 0])
+            totals[0] += words
+            totals[1] += int(duration)
+            totals[2] += 1
+        else:
+            best = self.index["best"].get(kind)
+            if best is None or wpm > best[0]:
+                self.index["best"][kind] = [round(wpm, 3), day, words]
+
+    def _catch_up(self):
+        # Bring the index up to date with records it hasn't seen, say
+        # after a crash between the append and the index write.
+        if self.index is None:
+            self._load()
+        try:
+            size = self.path.stat().st_size
+        except OSError:
+            size = 0
+        offset = self.index["offset"]
+        if size < offset:
+            self.index = self._empty()
+            offset = 0
+        if size == offset:
+            return size
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        pos = 0
+        while pos + STATS_RECORD.size <= len(data):
+            record = STATS_RECORD.unpack_from(data, pos)
+            body = data[pos + 4:pos + STATS_RECORD.size]
+            if zlib.crc32(body) != record[0] or record[1] >= len(STATS_KINDS):
+                break
+            self._add_to_index(STATS_KINDS[record[1]], *record[2:])
+            pos += STATS_RECORD.size
+        self.index["offset"] = offset + pos
+        self._save()
+        return size
+
+    def _locked(self):
+        # Two ina sessions may end at once. The lock keeps one from taking
+        # the other's half-written record for a torn one, and goes with
+        # the file when it's closed.
+        f = open(self.path, "ab")
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return f
+
+    def add(self, kind, start, duration, words, wpm=0.0):
+        record = STATS_RECORD.pack(0, STATS_KINDS.index(kind), start,
+                                   duration, words, wpm)
+        record = struct.pack("<I", zlib.crc32(record[4:])) + record[4:]
+        try:
+            with self._locked() as f:
+                size = self._catch_up()
+                if size > self.index["offset"]:
+                    # Drop a torn record left by a crash.
+                    f.truncate(self.index["offset"])
+                f.write(record)
+                f.flush()
+                self.index["offset"] += len(record)
+                self._add_to_index(kind, start, duration, words, wpm)
+                self._save()
+        except OSError:
+            return
+
+    def report(self, today=None):
+        import datetime
+        try:
+            with self._locked():
+                self._catch_up()
+        except OSError:
+            self._catch_up()
+        days = self.index["days"]
+        today = today or datetime.date.today()
+        weeks = {}
+        months = {}
+        for day, (words, seconds, _) in days.items():
+            date = datetime.date.fromisoformat(day)
+            week = "{}-W{:02d}".format(*date.isocalendar()[:2])
+            weeks[week] = weeks.get(week, 0) + words
+            months[day[:7]] = months.get(day[:7], 0) + words
+        lines = ["Words per day:"]
+        for back in range(6, -1, -1):
+            date = today - datetime.timedelta(days=back)
+            words, seconds = days.get(date.isoformat(), (0, 0, 0))[:2]
+            lines.append("  {} {}  {:>8}  {}".format(
+                date.isoformat(), date.strftime("%a"), words,
+                human_duration(seconds)))
+        lines.append("Words per week:")
+        for week in sorted(weeks)[-8:]:
+            lines.append("  {:<14}  {:>8}".format(week, weeks[week]))
+        lines.append("Words per month:")
+        for month in sorted(months)[-12:]:
+            lines.append("  {:<14}  {:>8}".format(month, months[month]))
+        lines.append("Best WPM:")
+        for kind in STATS_KINDS[1:]:
+            best = self.index["best"].get(kind)
+            if best is not None:
+                lines.append("  {:<14}  {:>8.1f}  ({} words on {})".format(
+                    CONTEST_TITLES.get(kind, kind), best[0], best[2], best[1]))
+        current, longest = stats_streaks(days, today)
+        lines.append("Streak: {} days, longest {} days".format(current, longest))
+        lines.append("All time: {} words in {} sessions".format(
+            sum(d[0] for d in days.values()), sum(d[2] for d in days.values())))
+        return "\n".join(lines)
+
+
+class WordRate:
+    # Words typed in each of the last few minutes of session time, one
+    # slot per second, with a running total kept for every window so
+    # reading a rate never walks the ring.
+    def __init__(self, windows=RATE_WINDOWS):
+        self.windows = windows
+        self.size = max(windows)
+        self.counts = array("l", [0]) * self.size
+        self.sums = array("l", [0]) * len(windows)
+        self.now = 0
+        self.typed = False
+        # Runs of seconds spent typing (1) or not (0), by log2 of length.
+        self.runs = (array("L", [0]) * RATE_BUCKETS,
+                     array("L", [0]) * RATE_BUCKETS)
+        self.run_kind = 0
+        self.run = 0
+
+    def _advance(self, clock):
+        second = int(clock)
+        gap = second - self.now
+        if gap <= 0:
+            return
+        self._close(self.typed, 1)
+        if gap > 1:
+            self._close(False, gap - 1)
+        self.typed = False
+        counts = self.counts
+        size = self.size
+        if gap >= size:
+            for i in range(size):
+                counts[i] = 0
+            for i in range(len(self.sums)):
+                self.sums[i] = 0
+        else:
+            for s in range(self.now + 1, second + 1):
+                for i, window in enumerate(self.windows):
+                    self.sums[i] -= counts[(s - window) % size]
+                counts[s % size] = 0
+        self.now = second
+
+    def _close(self, typed, seconds):
+        kind = int(typed)
+        if kind != self.run_kind:
+            if self.run:
+                self.runs[self.run_kind][self._bucket(self.run)] += 1
+            self.run_kind = kind
+            self.run = 0
+        self.run += seconds
+
+    @staticmethod
+    def _bucket(seconds):
+        return min(seconds.bit_length() - 1, RATE_BUCKETS - 1)
+
+    def add(self, clock, words):
+        self._advance(clock)
+        self.typed = True
+        if words:
+            self.counts[self.now % self.size] += words
+            for i in range(len(self.sums)):
+                self.sums[i] += words
+
+    def wpm(self, clock, window, since=0.0):
+        self._advance(clock)
+        span = min(window, clock - since)
+        if span < 1:
+            return None
+        if span >= window or since <= 0:
+            words = self.sums[self.windows.index(window)]
+        else:
+            # A contest younger than the window only counts its own words.
+            first = max(int(since), self.now - self.size + 1)
+            words = sum(self.counts[s % self.size]
+                        for s in range(first, self.now + 1))
+        return max(0, round(words * 60 / span))
+
+    def histogram(self, clock):
+        self._advance(clock)
+        idle, typing = (list(runs) for runs in self.runs)
+        if self.run:
+            (typing if self.run_kind else idle)[self._bucket(self.run)] += 1
+        return typing, idle
+
+
+class Profiler:
+    def __init__(self, trace_path=None):
+        self.trace_path = trace_path
+        self.stats = {}
+        self.events = [] if trace_path else None
+        self.origin = time.perf_counter()
+        self._arrived = None
+
+    def add(self, stage, start, end):
+        us = (end - start) * 1e6
+        stat = self.stats.get(stage)
+        if stat is None:
+            stat = self.stats[stage] = [0, 0.0, 0.0, [0] * PROFILE_BUCKETS]
+        stat[0] += 1
+        stat[1] += us
+        if us > stat[2]:
+            stat[2] = us
+        stat[3][min(int(us).bit_length(), PROFILE_BUCKETS - 1)] += 1
+        if self.events is not None and len(self.events) < PROFILE_TRACE_LIMIT:
+            self.events.append({"name": stage, "ph": "X", "pid": os.getpid(),
+                                "tid": threading.get_ident(),
+                                "ts": (start - self.origin) * 1e6, "dur": us})
+
+    def instrument(self, obj, name, stage=None):
+        # Only the instance is patched, so with profiling off nothing on
+        # the hot path changes at all.
+        method = getattr(obj, name)
+        stage = stage or name.strip("_")
+        clock = time.perf_counter
+        add = self.add
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                add(stage, start, clock())
+        setattr(obj, name, timed)
+
+    def watch_input(self, ui):
+        getkeys = ui.getkeys
+
+        def timed(*args, **kwargs):
+            if self._arrived is not None:
+                self.add("key total", self._arrived, time.perf_counter())
+                self._arrived = None
+            keys = getkeys(*args, **kwargs)
+            if keys:
+                self._arrived = time.perf_counter()
+            return keys
+        ui.getkeys = timed
+        ui.stdscr = TimedWindow(ui.stdscr, self)
+
+    @staticmethod
+    def _percentile(buckets, count, fraction):
+        seen = 0
+        for i, n in enumerate(buckets):
+            seen += n
+            if seen >= count * fraction:
+                return 1 << i
+        return 1 << len(buckets)
+
+    def summary(self):
+        lines = ["{:<14} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+            "stage", "count", "mean us", "p50 us<", "p99 us<", "max us")]
+        for stage, (count, total, top, buckets) in sorted(self.stats.items()):
+            lines.append("{:<14} {:>8} {:>10.1f} {:>10} {:>10} {:>10.0f}".format(
+                stage, count, total / count,
+                self._percentile(buckets, count, 0.5),
+                self._percentile(buckets, count, 0.99), top))
+        return "\n".join(lines)
+
+    def finish(self, out):
+        out.write(self.summary() + "\n")
+        if self.events is not None:
+            # Never over anything but an earlier trace: a mistyped name may
+            # well be the manuscript.
+            mode = "x"
+            try:
+                with open(self.trace_path, "rb") as f:
+                    if f.read(len(TRACE_HEAD)) != TRACE_HEAD:
+                        out.write("Not writing the trace over {}\n".format(
+                            self.trace_path))
+                        return
+                mode = "w"
+            except FileNotFoundError:
+                pass
+            with open(self.trace_path, mode) as f:
+                json.dump({"traceEvents": self.events,
+                           "displayTimeUnit": "ms"}, f)
+            out.write("Trace written to {}\n".format(self.trace_path))
+
+
+class TimedWindow:
+    def __init__(self, window, profiler):
+        self._window = window
+        self.refresh = self._timed_refresh
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self._window, name)
+
+    def _timed_refresh(self):
+        start = time.perf_counter()
+        self._window.refresh()
+        self._profiler.add("refresh", start, time.perf_counter())
+
+
+class Contest:
+    mode = None
+    kind = None
+    # The id a war server gave it, when everyone at a write-in is in it.
+    shared = None
+
+    def __init__(self, start, words, target):
+        self.start = start
+        self.start_words = words
+        self.target = target
+        self.end = None
+        self.end_words = None
+
+    def written(self, words):
+        return (words if self.end is None else self.end_words) - self.start_words
+
+    def elapsed(self, now):
+        return (now if self.end is None else self.end) - self.start
+
+    def wpm(self, now, words):
+        elapsed = self.elapsed(now)
+        return self.written(words) / (elapsed / 60) if elapsed > 0 else 0.0
+
+    def next_tick(self, now):
+        # When the clock on the status line next shows a different second.
+        return now + 1 - (now - self.start) % 1
+
+    def finish_time(self, now):
+        return now
+
+    def goal(self):
+        return None
+
+
+class WordWar(Contest):
+    mode = kind = "war"
+
+    def next_tick(self, now):
+        return min(now + 1 - (now - self.start - self.target) % 1,
+                   self.start + self.target)
+
+    def finish_time(self, now):
+        return self.start + self.target
+
+    def show(self, now, words):
+        return (self.mode, max(0, self.target - self.elapsed(now)),
+                self.written(words), self.wpm(now, words))
+
+    def summary(self, words):
+        return "{} over: {} words, {:.1f} WPM".format(
+            CONTEST_TITLES[self.mode], self.written(words),
+            self.wpm(self.end, words))
+
+
+class Sprint(WordWar):
+    # A word war that starts by itself at a time set in the settings.
+    mode = "sprint"
+
+
+class Pomodoro(WordWar):
+    mode = kind = "pomodoro"
+
+    def __init__(self, start, words, target, during):
+        WordWar.__init__(self, start, words, target)
+        self.during = during
+
+    def next_tick(self, now):
+        if self.end is None and "time" not in self.during:
+            # The spinner turns with the seconds of the clock, not the
+            # contest.
+            return min(now + 1 - now % 1, self.start + self.target)
+        return WordWar.next_tick(self, now)
+
+    def show(self, now, words):
+        if self.end is not None:
+            return WordWar.show(self, now, words)
+        if "time" in self.during:
+            left = max(0, self.target - self.elapsed(now))
+        else:
+            left = "[" + "\\-/|"[int(now) % 4] + "]"
+        return (self.mode, left,
+                self.written(words) if "words" in self.during else None,
+                self.wpm(now, words) if "rate" in self.during else None)
+
+
+class WordRace(Contest):
+    mode = kind = "race"
+
+    def goal(self):
+        return self.start_words + self.target
+
+    def show(self, now, words):
+        return (self.mode, self.elapsed(now),
+                max(0, self.target - self.written(words)),
+                self.wpm(now, words))
+
+    def summary(self, words):
+        return "Word Race over: {} words in {}".format(
+            self.written(words), human_duration(self.end - self.start))
+
+
+class WarClient:
+    # The reader thread hands every message from the server to deliver.
+    # Progress is only ever sent by the reporter thread, every
+    # WAR_REPORT_INTERVAL, and only once it has changed, so typing never
+    # turns into traffic.
+    def __init__(self, address, name, deliver):
+        self.sock = connect_address(address)
+        self.deliver = deliver
+        self.progress = None
+        self._sent = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._send({"hello": name})
+        threading.Thread(target=self._read, daemon=True).start()
+        threading.Thread(target=self._report_loop, daemon=True).start()
+
+    def _send(self, message):
+        with self._lock:
+            self.sock.sendall((json.dumps(message) + "\n").encode())
+
+    def _read(self):
+        try:
+            with self.sock.makefile("rb") as f:
+                for line in f:
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(message, dict):
+                        self.deliver(message)
+        except OSError:
+            pass
+        if not self._closed.is_set():
+            self.deliver({"gone": True})
+
+    def _report_loop(self):
+        while not self._closed.wait(WAR_REPORT_INTERVAL):
+            try:
+                self.report()
+            except OSError:
+                return
+
+    def report(self):
+        progress = self.progress
+        if progress is None or progress == self._sent:
+            return
+        self._sent = progress
+        self._send({"id": progress[0], "words": progress[1]})
+
+    def close(self):
+        import socket
+        self._closed.set()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class WarServer:
+    def __init__(self, out):
+        self.out = out
+        # writer -> [name, words, when the race was finished]
+        self.writers = {}
+        self.contest = None
+        self.serial = 0
+        self.changed = False
+
+    def _now(self):
+        import asyncio
+        return asyncio.get_running_loop().time()
+
+    async def client(self, reader, writer):
+        entry = ["?", 0, None]
+        self.writers[writer] = entry
+        if self.contest is not None:
+            # Late arrivals join in; their clock starts where everyone's is.
+            self._send(writer, {"start": self._spec()})
+        try:
+            async for line in reader:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(message, dict):
+                    self._message(entry, message)
+        except (ValueError, OSError):
+            pass
+        finally:
+            self.writers.pop(writer, None)
+            self.changed = True
+            writer.close()
+
+    def _message(self, entry, message):
+        if "hello" in message:
+            entry[0] = str(message["hello"])[:WAR_NAME_LIMIT]
+            self.changed = True
+        contest = self.contest
+        if contest is None or message.get("id") != contest["id"]:
+            return
+        try:
+            entry[1] = int(message["words"])
+        except (KeyError, TypeError, ValueError):
+            return
+        self.changed = True
+        if (contest["kind"] == "race" and entry[2] is None
+                and entry[1] >= contest["target"]):
+            entry[2] = self._now()
+
+    def _spec(self):
+        contest = self.contest
+        return {"id": contest["id"], "kind": contest["kind"],
+                "target": contest["target"], "in": contest["start"] - self._now()}
+
+    def _send(self, writer, message):
+        writer.write((json.dumps(message) + "\n").encode())
+
+    def start(self, kind, target):
+        self.serial += 1
+        self.contest = {"id": self.serial, "kind": kind, "target": target,
+                        "start": self._now() + WAR_COUNTDOWN}
+        for entry in self.writers.values():
+            entry[1] = 0
+            entry[2] = None
+        data = (json.dumps({"start": self._spec()}) + "\n").encode()
+        for writer in list(self.writers):
+            writer.write(data)
+        self.out.write("{} starts in {:.0f} seconds for {} writers.\n".format(
+            CONTEST_TITLES[kind], WAR_COUNTDOWN, len(self.writers)))
+        self.out.flush()
+
+    def _ranked(self):
+        # Race finishers first, in the order they finished.
+        return sorted(self.writers.items(), key=lambda item: (
+            item[1][2] is None, item[1][2] or 0, -item[1][1]))
+
+    def broadcast(self, final=False):
+        ranked = self._ranked()
+        board = json.dumps({
+            "id": self.contest["id"], "count": len(ranked), "final": final,
+            "top": [entry[:2] for _, entry in ranked[:WAR_BOARD_TOP]]})
+        # The board is encoded once; each writer only gets its rank added.
+        for rank, (writer, entry) in enumerate(ranked, 1):
+            if writer.transport.get_write_buffer_size() > WAR_BUFFER_LIMIT:
+                # Not reading; don't let it hold the rest up.
+                writer.close()
+                continue
+            writer.write('{{"rank": {}, "board": {}}}\n'.format(
+                rank, board).encode())
+        self.print_board(ranked, final)
+
+    def print_board(self, ranked, final):
+        contest = self.contest
+        if final:
+            self.out.write("{} over:\n".format(CONTEST_TITLES[contest["kind"]]))
+            for rank, (_, (name, words, _)) in enumerate(ranked, 1):
+                self.out.write("{:>4}. {:<{width}} {:>6}\n".format(
+                    rank, name, words, width=WAR_NAME_LIMIT))
+        else:
+            clock = self._now() - contest["start"]
+            if contest["kind"] == "war":
+                clock = contest["target"] - clock
+            self.out.write("{} {}  {}  ({} writers)\n".format(
+                human_duration(max(0, clock)),
+                CONTEST_SHORT[contest["kind"]],
+                ", ".join("{} {}".format(name, words)
+                          for _, (name, words, _)
+                          in ranked[:WAR_BOARD_TOP]),
+                len(ranked)))
+        self.out.flush()
+
+    def finish(self):
+        self.broadcast(final=True)
+        self.contest = None
+        self.changed = False
+
+    def command(self, line):
+        words = line.split()
+        if not words:
+            return
+        try:
+            if words[0] == "war" and len(words) == 2:
+                length = from_human_duration(words[1], minutes=True)
+                if length > 0:
+                    self.start("war", length)
+                    return
+            elif words[0] == "race" and len(words) == 2:
+                target = int(words[1])
+                if target > 0:
+                    self.start("race", target)
+                    return
+        except ValueError:
+            pass
+        if words[0] in ("stop", "end") and self.contest is not None:
+            self.finish()
+        elif words[0] == "board" and self.contest is not None:
+            self.print_board(self._ranked(), False)
+        elif words[0] != "board":
+            self.out.write("Commands: war MINUTES, race WORDS, board, stop\n")
+            self.out.flush()
+
+    def tick(self):
+        contest = self.contest
+        if contest is None:
+            return
+        now = self._now()
+        if contest["kind"] == "war":
+            # Everyone's last words arrive a little after the bell.
+            if now >= contest["start"] + contest["target"] + WAR_GRACE:
+                self.finish()
+                return
+        elif self.writers and all(entry[2] is not None
+                                  for entry in self.writers.values()):
+            self.finish()
+            return
+        if self.changed and now >= contest["start"]:
+            self.changed = False
+            self.broadcast()
+
+    async def run(self, address, source):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        family, where = parse_address(address)
+        if family == "unix":
+            if remove_socket(where) is False:
+                raise ValueError("{} is there and is not a socket".format(
+                    where))
+            server = await asyncio.start_unix_server(self.client, where,
+                                                     backlog=WAR_BACKLOG)
+        else:
+            server = await asyncio.start_server(self.client, *where,
+                                                backlog=WAR_BACKLOG)
+        pending = bytearray()
+        done = loop.create_future()
+
+        def typed():
+            data = os.read(source.fileno(), 4096)
+            if not data:
+                loop.remove_reader(source.fileno())
+                return
+            pending.extend(data)
+            while b"\n" in pending:
+                line, _, rest = bytes(pending).partition(b"\n")
+                pending[:] = rest
+                if line.strip() == b"quit":
+                    done.set_result(None)
+                    return
+                self.command(line.decode(errors="replace"))
+        loop.add_reader(source.fileno(), typed)
+        self.out.write("Serving word wars on {}.\n".format(address))
+        self.command("help")
+        async with server:
+            while not done.done():
+                await asyncio.sleep(WAR_BOARD_INTERVAL)
+                self.tick()
+            # Hang up on everyone, and give their handlers a moment to see
+            # it, so none is cancelled mid-read on the way out.
+            for writer in list(self.writers):
+                writer.close()
+            await asyncio.sleep(0.1)
+        if family == "unix":
+            remove_socket(where)
+
+
 class IdioticNanowrimoAppender:
     pomodoro_during_run = {"rate"}
     pomodoro_time = DEFAULT_POMODORO_TIME
@@ -469,7 +2127,7 @@ class IdioticNanowrimoAppender:
 
     def _parse(self, argv):
         global dist_config
-        args = parser.parse_args(argv)
+        args = make_parser().parse_args(argv)
         if args.user_config is not None:
             home_dir = Path(args.user_config)
         else:
@@ -479,89 +2137,95 @@ class IdioticNanowrimoAppender:
                 if trial.exists():
                     home_dir = trial
         home_dir.mkdir(parents=True, exist_ok=True)
+        self.word_index = WordCountIndex(home_dir / "wordcounts.json")
+        self.stats = StatsStore(home_dir)
+        self.show_stats = args.stats
+        self.from_stdin = args.stdin
+        self.serve_address = args.serve
+        self.war_address = args.join
         home_config = home_dir / "settings.conf"
         if home_config.exists():
-            config.read(str(home_config)) 
             if args.generate_config:
                 home_config_dist = home_config.with_suffix(".conf.dist")
                 home_config_dist.write_text(dist_config)
         elif args.generate_config:
             home_config.write_text(dist_config)
-
-        if "general" not in config:
-            config.add_section("general")
-        if "pomodoro-during-run" in config["general"]:
-            self.pomodoro_during_run = set(split(config["general"]["pomodoro-during-run"].strip()))
-        self.pomodoro_time = config["general"].get("pomodoro-time", DEFAULT_POMODORO_TIME).strip()
-        self.truncate_enabled = config["general"].get("truncate-enabled", "False").strip()
-        if not self.truncate_enabled or self.truncate_enabled.lower() in ("false", "0", 0):
-            self.truncate_enabled = False
-        else:
-            self.truncate_enabled = True
-        if "tail-count" in config["general"]:
-            tc = config["general"]["tail-count"].strip().split()
-            try:
-                self.tail_count = int(tc[0])
-                if len(tc) > 1:
-                    self.tail_type = tc[1]
-            except ValueError:
-                pass
-        untitled_filename = config["general"].get("untitled-filename", DEFAULT_UNTITLED_FILENAME).strip()
+        settings = load_settings(home_config)
+
+        if settings["pomodoro-during-run"] is not None:
+            self.pomodoro_during_run = set(settings["pomodoro-during-run"])
+        self.pomodoro_time = settings["pomodoro-time"]
+        self.sprints = parse_sprints(settings["sprints"])
+        self.war_name = (settings["war-name"] or os.environ.get("USER")
+                         or "writer")
+        self.truncate_enabled = settings["truncate-enabled"]
+        if settings["tail-count"] is not None:
+            self.tail_count, self.tail_type = settings["tail-count"]
         self.one_line = args.one_line
         if args.file:
             self.filename = args.file
         else:
-            self.filename = os.path.expanduser(time.strftime(untitled_filename))
+            self.filename = os.path.expanduser(time.strftime(settings["untitled-filename"]))
         self.next_filename = None
-        self.todo_marker = config["general"].get("todo-marker", DEFAULT_TODO_MARKER)
-        self.wrap_margin = int(config["general"].get("wrap-margin", DEFAULT_WRAP_MARGIN))
+        self.todo_marker = settings["todo-marker"]
+        self.wrap_margin = settings["wrap-margin"]
+        self.notification = settings["notification"]
+        self.durability = settings["durability"]
+        self.journal = settings["journal"]
+        self.status_diff = settings["status-diff"]
+        profile = settings["profile"]
+        if args.profile_trace:
+            profile = args.profile_trace
+        elif args.profile:
+            profile = "on"
+        self.profiler = None
+        if profile.lower() not in ("", "off", "false", "0", "no"):
+            trace = None
+            if profile.lower() not in ("on", "true", "1", "yes"):
+                trace = os.path.expanduser(profile)
+            self.profiler = Profiler(trace)
 
     def check_any_file(self, filename):
-        ret = None
-        whole = None
         fpath = Path(filename)
-        if fpath.exists():
-            whole = fpath.read_text()
-        ret = whole
         self.start_words = 0
-        if whole is not None:
-            self.start_words = len(whole.split())
-            if self.tail_type in ("word", "words"):
-                t = whole.replace("\n\n"," [NEW-PARAGRAPH]").split()[-self.tail_count:]
-                ret = " ".join(t).replace(" [NEW-PARAGRAPH]", "\n\n")
-                if not whole.endswith("\n\n") and whole.endswith("\n"):
-                    ret = ret + "\n"
-                elif whole.endswith(" "):
-                    ret = ret + " "
-            elif self.tail_type in ("line", "lines"):
-                ret = "\n".join(whole.split("\n")[-self.tail_count:])
-            elif self.tail_type in ("character", "characters", "codepoint",
-    "codepoints", "byte", "bytes", "char", "chars"):
-                ret = whole[-self.tail_count:]
-            elif self.tail_type in ("para", "paras", "paragraph", "paragraphs"):
-                t = whole.split("\n\n")
-                r = []
-                t.reverse()
-                for para in t:
-                    para = para.strip()
-                    if para == "":
-                        continue
-                    r.append(para)
-                    if len(r) >= self.tail_count:
-                        break
-                r.reverse()
-                if whole.endswith("\n\n"):
-                    r.append("")
-                    ret = "\n\n".join(r)
-                elif whole.endswith("\n"):
-                    ret = "\n\n".join(r) + "\n"
-                elif whole.endswith(" "):
-                    ret = "\n\n".join(r) + " "
-                else:
-                    ret = "\n\n".join(r)
-            else:
-                ret = whole[-DEFAULT_TAIL_COUNT:]
-        return ret
+        self.start_pending = False
+        self.start_size = 0
+        self._start_generation += 1
+        if not fpath.exists():
+            return None
+        self.start_size = fpath.stat().st_size
+        got = self.word_index.cached(filename)
+        if got is None and self.start_size <= BACKGROUND_COUNT_SIZE:
+            got = self.word_index.count(filename)
+        if got is not None:
+            self._start_counted(self._start_generation, *got)
+        else:
+            self._count_start(filename, self.start_size)
+        return read_tail(filename, self.tail_count, self.tail_type)
+
+    def _count_start(self, filename, size):
+        # Counting a big file takes a while, so it happens in the
+        # background while you type. new_words keeps its own tally, so the
+        # two simply add up once the count arrives.
+        self.start_pending = True
+        generation = self._start_generation
+
+        def work():
+            try:
+                words, partial = self.word_index.count(filename, size)
+            except OSError:
+                words, partial = 0, False
+            self.ui.post(lambda: self._start_counted(generation, words, partial))
+        threading.Thread(target=work, daemon=True).start()
+
+    def _start_counted(self, generation, words, partial):
+        if generation != self._start_generation:
+            return
+        # A word left unfinished at the end of the file is counted again
+        # once you finish typing it.
+        # Words other programs appended meanwhile are already in start_words.
+        self.start_words += words - 1 if partial else words
+        self.start_pending = False
 
 
     def check_file(self):
@@ -570,172 +2234,316 @@ class IdioticNanowrimoAppender:
     def __init__(self, args):
         self._parse(args)
         self.ui = None
+        self.project = None
 
         self.new_words = 0
         self.start_duration = 0
-        self.contest_mode = None
-        self.contest_starttime = None
-        self.contest_startwords = None
-        self.contest_time = None
-        self.contest_words = None
-        self.contest_data = None
-        self.contest_wpm = None 
+        # Contests on show, running or just finished. What wakes them up
+        # is kept apart: _timers holds (when, seq, action, item) in order
+        # of time and _goals holds (words, seq, race) in order of words.
+        self.contests = []
+        self._timers = []
+        self._goals = []
+        self._timer_seq = 0
+        # The wall clock start of each sprint rule's latest sprint.
+        self._sprints_started = {}
+        self.war = None
+        self.shared = None
+        self.board = None
+        self._status_shown = None
+        self.session_start = None
+        self.rate = WordRate()
+        self._rate_origin = time.perf_counter()
+        self._paused = 0.0
+        self.project_base = None
+        self.project_pending = False
+        self._project_generation = 0
+        self.start_pending = False
+        self.start_size = 0
+        self._start_generation = 0
+        self._check_queued = False
 
     def _reload(self, outf = None):
         if outf is not None:
             outf.flush()
         tail = self.check_file() 
-        self.was_seperator = True
-        if tail and tail[-1] and tail[-1][-1] not in " \n\r\t":
-            self.was_seperator = False
-            self.start_words -= 1
+        self.was_seperator = not (tail and tail[-1] not in WORD_SEPARATORS)
 
+        self._repaint(tail)
+
+    def _repaint(self, tail):
         self.ui.reset()
-        self.ui.status_line(run_time=time.perf_counter() - self.start_time,
-                            total_words=self.start_words + self.new_words,
-                            new_words = self.new_words)
+        self._update_status()
         self.ui.write("\n")
         self.ui.write("Use ^X to exit. ^W for Word War. ^R for Word Race.\n" +
                   "^P to Pause Session. ^B for One-Line Mode. ^T for Pomodoro.\n\n")
+        neighbours = self._neighbours()
+        if neighbours:
+            self.ui.write(neighbours + "\n\n")
         if tail is None or tail.strip() == "":
             self.ui.write("(Empty File)\n")
         else:
             self.ui.write("[...]")
             self.ui.write(tail)
 
-    def _show_outline(self, order):
+    def _project(self):
+        directory = Path(self.filename).parent
+        if self.project is None or self.project.directory != directory:
+            self.project = ProjectIndex(directory)
+        return self.project
+
+    def _neighbours(self):
+        project = self._project()
+        name = Path(self.filename).name
+        prev = project.neighbour(name, -1)
+        if prev is None:
+            return None
+        after = project.neighbour(name, 1)
+        if after not in project.files:
+            after += " (new)"
+        if prev:
+            return "PageUp: {}  PageDown: {}".format(prev, after)
+        return "PageDown: {}".format(after)
+
+    def _count_project(self):
+        self.project_base = None
+        self.project_pending = False
+        self._project_generation += 1
         fn = Path(self.filename)
-        c = re.split("[-_]", fn.stem)
-        if len(c) == 1:
-            c = fn.stem.split(".")
-            spec = c[0] + "*"
-        else:
-            spec = c[0] + "*" + fn.suffix
-        things = []
-        for what in glob.glob(str(fn.parent / spec)):
-            p = Path(what)
-            if not p.is_file():
-                continue
-            if p == fn:
-                continue
-            if p.suffix == ".bak" or p.suffix.endswith("~") or p.suffix.startswith("~") or p.suffix.endswith("#"):
-                continue
-            things.append(str(what))
+        chapters = self._project().chapters(fn.name) or ()
+        others = [str(fn.parent / name) for _, name in chapters
+                  if name != fn.name]
+        if not others:
+            return
+        self.project_pending = True
+        generation = self._project_generation
+        typed = self.new_words
+
+        def work():
+            total = sum(self.word_index.count_all(others))
+            self.ui.post(lambda: self._project_counted(generation, total - typed))
+        threading.Thread(target=work, daemon=True).start()
+
+    def _project_counted(self, generation, base):
+        # A switch to another file while counting makes the result stale.
+        if generation == self._project_generation:
+            self.project_base = base
+            self.project_pending = False
+
+    def _project_words(self):
+        if self.project_pending:
+            return "..."
+        if self.project_base is None:
+            return None
+        if self.start_pending:
+            return "..."
+        return self.project_base + self.start_words + self.new_words
+
+    def _show_outline(self, order):
+        spec, things = self._project().outlines(Path(self.filename).name)
         if not things:
             self.ui.write("<<Could not find navel: {}.>>\n".format(spec))
             return
-        things.sort()
         if order >= len(things):
             order = 0
         if order < 0 and -order > len(things):
             order = 0
-        outline = Path(things[order])
-        tail = None
-        if outline.exists():
-            tail = outline.read_text()
-        self.ui.write("\n")
-        if tail is None or tail.strip() == "":
-            self.ui.write("<<Not available.>>\n")
-        else:
-            self.ui.write("<<{}>> ".format(outline))
-            self.ui.write(tail.strip())
-            self.ui.write(" <<{}>>\n".format(outline))
+        outline = Path(self.filename).parent / things[order]
+        try:
+            shown = self.ui.view_file(outline)
+        except OSError:
+            shown = False
+        if not shown:
+            self.ui.write("\n<<Not available.>>\n")
 
     def load(self, stdscr): 
         if not self.ui:
             self.ui = UiComponent(stdscr)
             self.ui.toggle_oneline(self.one_line)
             self.ui.wrap_margin = self.wrap_margin
+            self.ui.status_diff = self.status_diff
+            self.ui.notification = self.notification
+            self.ui.bracketed_paste(True)
+            if self.profiler is not None:
+                for name in ("_run_keys", "_run_contests", "_update_status"):
+                    self.profiler.instrument(self, name)
+                for name in ("status_line", "redraw", "write"):
+                    self.profiler.instrument(self.ui, name)
+                self.profiler.watch_input(self.ui)
         self.start_time = time.perf_counter() 
 
+    def _rate_clock(self):
+        # Seconds of session so far, leaving out time spent paused.
+        return time.perf_counter() - self._rate_origin - self._paused
+
     def _update_status(self):
+        now = time.perf_counter()
+        run_time = now - self.start_time + self.start_duration
+        contests = [contest.show(now, self.new_words)
+                    for contest in self.contests]
+        clock = self._rate_clock()
+        session_wpm = tuple(self.rate.wpm(clock, window)
+                            for window in RATE_WINDOWS)
+        contest_rate = None
+        board = self._board_text()
+        if len(self.contests) == 1 and self.contests[0].end is None:
+            since = clock - (now - self.contests[0].start)
+            contest_rate = self.rate.wpm(clock, RATE_WINDOWS[0], since)
+        # Only what the status line actually displays decides whether it
+        # needs to be redrawn.
+        project_words = self._project_words()
+        total_words = self.start_words + self.new_words
+        if self.start_pending:
+            total_words = "..."
+        shown = (int(run_time),
+                 tuple((mode, human_duration(left), words,
+                        round(wpm, 3) if isinstance(wpm, float) else wpm)
+                       for mode, left, words, wpm in contests),
+                 total_words, self.new_words, project_words,
+                 session_wpm, contest_rate, board, self.ui.oneln_mode)
+        if shown == self._status_shown and not self.ui.status_dirty:
+            return
+        self._status_shown = shown
         self.ui.status_line(
-            run_time = time.perf_counter()
-                        - self.start_time + self.start_duration,
-            contest_wpm = self.contest_wpm,
-            contest_time = self.contest_time,
-            contest_mode = self.contest_mode,
-            contest_words = self.contest_words,
-            total_words = self.start_words + self.new_words,
-            new_words = self.new_words)
-
-    def _do_input(self, outf, key): 
-        if key in "- \n\t":
-            if not self.was_seperator:
-                self.new_words += 1
-                outf.flush()
-            self.was_seperator = True
-        else:
-            self.was_seperator = False
-        self.ui.shared_write(outf, key)
+            run_time = run_time,
+            contests = contests,
+            total_words = total_words,
+            new_words = self.new_words,
+            project_words = project_words,
+            session_wpm = session_wpm,
+            contest_rate = contest_rate,
+            board = board)
+
+    def _next_deadline(self):
+        now = time.perf_counter()
+        ticks = [now - self.start_time + self.start_duration,
+                 self._rate_clock()]
+        # Every clock on the status line shows whole seconds, so the
+        # display can only change when one of them crosses a second.
+        wait = min(1 - t % 1 for t in ticks)
+        if self._timers:
+            wait = min(wait, max(0, self._timers[0][0] - now))
+        effect = self.ui.effect_deadline()
+        if effect is not None:
+            wait = min(wait, max(0, effect))
+        return wait + DEADLINE_SLACK
+
+    def _watch_callback(self, outf):
+        # Called from the watcher thread whenever the file changes,
+        # including for our own writes; the check itself is cheap.
+        def changed():
+            if not self._check_queued:
+                self._check_queued = True
+                self.ui.post(lambda: self._check_foreign(outf))
+        return changed
+
+    def _check_foreign(self, outf):
+        self._check_queued = False
+        if not outf.closed:
+            outf.check_foreign()
+
+    def _absorb_foreign(self, outf):
+        global code
+        found = outf.take_foreign()
+        if not found:
+            return
+        words = 0
+        with open(self.filename, "rb") as f:
+            for start, end in found:
+                # Only the new bytes are read, plus the one before them to
+                # know whether they finish a word already in the file.
+                partial = False
+                if start > 0:
+                    f.seek(start - 1)
+                    partial = f.read(1).translate(WORD_MARKS) == b"\x01"
+                count, partial = _count_stream(f, int(partial), partial,
+                                               end - start)
+                words += count - partial
+            start, end = found[0]
+            if (len(found) == 1 and end == outf.size()
+                    and end - start <= TAIL_BLOCK_SIZE):
+                # Nothing of ours came after it, so it simply goes on the
+                # end of what's shown.
+                f.seek(start)
+                text = f.read(end - start).decode(code, errors="replace")
+                self.start_words += words
+                self.was_seperator = text[-1:] in WORD_SEPARATORS
+                self.ui.write(text)
+                return
+        self.start_words += words
+        # Text we'd typed already has to be shown after theirs.
+        outf.flush()
+        tail = read_tail(self.filename, self.tail_count, self.tail_type)
+        self.was_seperator = not (tail and tail[-1] not in WORD_SEPARATORS)
+        self._repaint(tail)
+
+    def _do_input(self, outf, text): 
+        global code
+        words, partial = count_words(text.encode(code, errors="replace"),
+                                     not self.was_seperator)
+        self.was_seperator = not partial
+        self.ui.shared_write(outf, text)
+        self.rate.add(self._rate_clock(), words)
+        if words:
+            self.new_words += words
+            outf.end_word()
 
     def _do_todo(self, outf): 
+        words = 1
         if not self.was_seperator:
-            self.new_words += 1
+            words += 1
             self.ui.shared_write(outf, " ")
         self.was_seperator = True
         self.ui.shared_write(outf, self.todo_marker)
         self.ui.shared_write(outf, " ")
-        self.new_words += 1
-        outf.flush()
+        self.new_words += words
+        self.rate.add(self._rate_clock(), words)
+        outf.end_word()
 
     def _do_pomodoro(self): 
-        self.contest_data = from_human_duration(self.pomodoro_time, minutes=True)
-        self.contest_starttime = time.perf_counter()
-        self.contest_startwords = self.new_words
-        self.contest_words = None
-        self.contest_time = None
-        self.contest_mode = "pomodoro"
+        length = from_human_duration(self.pomodoro_time, minutes=True)
+        self._start_contest(Pomodoro(time.perf_counter(), self.new_words,
+                                     length, self.pomodoro_during_run))
 
     def _do_pause(self):
-        self.start_duration += time.perf_counter() - self.start_time
-        self.ui.pause()
+        paused = time.perf_counter()
+        self.start_duration += paused - self.start_time
+        self.ui.pause(self.rate.histogram(self._rate_clock()))
         self.start_time = time.perf_counter()
+        self._paused += self.start_time - paused
 
     def _do_war(self):
         question = "Word war for how long?"
         got = self.ui.query(question) 
-        self.contest_time = None
-        self.contest_words = None
-        self.contest_wpm = None 
+        length = 0
         if got.strip() != "":
-            self.contest_data = from_human_duration(got, minutes=True)
-            if self.contest_data != 0:
-                self.contest_time = time.perf_counter()
-                self.contest_starttime = self.contest_time
-                self.contest_words = 0
-                self.contest_startwords = self.new_words
-                self.contest_mode = "war"
-            else:
-                self.contest_mode = None
+            try:
+                length = from_human_duration(got, minutes=True)
+            except ValueError:
+                length = 0
+        if length > 0:
+            self._start_contest(WordWar(time.perf_counter(), self.new_words,
+                                        length))
         else:
-            self.contest_mode = None
+            self._clear_contests()
 
     def _do_race(self): 
         question = "Race for how many words?"
         got = self.ui.query(question)
-        self.contest_time = None
-        self.contest_words = None
-        self.contest_wpm = None 
+        target = 0
         if got.strip() != "":
             try:
-                self.contest_data = int(got)
+                target = int(got)
             except ValueError:
-                self.contest_data = 0
-            if self.contest_data != 0:
-                self.contest_starttime = time.perf_counter()
-                self.contest_startwords = self.new_words
-                self.contest_time = time.perf_counter() - self.contest_starttime
-                self.contest_words = self.new_words - self.contest_startwords
-                self.contest_mode = "race"
-            else:
-                self.contest_mode = None
+                target = 0
+        if target > 0:
+            self._start_contest(WordRace(time.perf_counter(), self.new_words,
+                                         target))
         else:
-            self.contest_mode = None
+            self._clear_contests()
 
     def _do_oneline(self):
-        if not self.ui.toggle_oneline():
-            self._reload()
+        self.ui.toggle_oneline()
 
     def _run_key(self, outf, key):
         if isinstance(key, str) and key and key not in ("\t", "\a"):
@@ -756,12 +2564,12 @@ class IdioticNanowrimoAppender:
             self._do_race()
         elif key == CTRL_B:
             self._do_oneline()
-        elif key == 393 or key == 262:
+        elif key == OUTLINE_KEYS[0] or key == OUTLINE_KEYS[1]:
             self._show_outline(0)
-        elif key == 402 or key == 360:
+        elif key == OUTLINE_KEYS[2] or key == OUTLINE_KEYS[3]:
             self._show_outline(-1)
         elif key == curses.KEY_RESIZE or key == CTRL_L:
-            self._reload(outf)
+            self.ui.redraw()
         elif key == 336 or key == 338:
             self._load_next(outf, 1)
         elif key == 337 or key == 339:
@@ -770,119 +2578,878 @@ class IdioticNanowrimoAppender:
             self._do_todo(outf)
             # self.ui.write(str(key))
 
+    def _run_keys(self, outf, keys):
+        text = []
+        for i, key in enumerate(keys):
+            if isinstance(key, str) and key and key not in ("\t", "\a"):
+                text.append(key)
+                continue
+            if text:
+                self._do_input(outf, "".join(text))
+                text = []
+            if key == CTRL_X:
+                return False
+            if key in INTERACTIVE_KEYS:
+                # Anything typed after this belongs to the prompt.
+                self.ui.unget(keys[i + 1:])
+                self._run_key(outf, key)
+                return True
+            self._run_key(outf, key)
+            if outf.closed:
+                self.pending_keys = keys[i + 1:]
+                return True
+        if text:
+            self._do_input(outf, "".join(text))
+        return True
+
     def _load_next(self, outf, offset):
         fn = Path(self.filename)
-        pattern = re.compile(r"([0-9]+)")
-        got = re.findall(pattern, fn.stem)
-        if len(got) != 1:
-            return
-        orig = got[0]
-        newn = int(orig) + offset
-        if newn < 1:
-            self.ui.flash()
-            return
-        new = str(newn)
-        while len(new) < len(orig):
-            new = "0" + new
-        self.next_filename = self.filename.replace(orig, new)
+        name = self._project().neighbour(fn.name, offset)
+        if name is None:
+            return
+        if not name:
+            self.ui.notify()
+            return
+        self.next_filename = str(fn.parent / name)
         outf.close()
         return 
 
     def _do_backspace(self, outf):
-        self.next_filename = self.filename
-        fn = Path(self.filename)
-        outf.close()
-        everything = fn.read_text()
-        if everything == "":
-            self.ui.flash()
+        outf.flush()
+        outf.check_foreign()
+        size = os.fstat(outf.fileno()).st_size
+        if size == 0:
+            self.ui.notify()
             return
-        self.new_words -= 1
-        trunc = -1
-        need_space = ""
-        try:
-            while everything[trunc].isspace():
-                trunc -= 1
-            while not everything[trunc].isspace():
-                trunc -= 1
-            if everything[trunc].isspace():
-                need_space = " "
-        except IndexError:
-            trunc=0
-        fnn = Path(self.filename + ".new")
-        fnn.write_text(everything[:trunc] + need_space)
-        fnn.rename(fn)
-        return
+        with open(self.filename, "rb") as f:
+            cut, need_space = _find_word_start(f, size)
+            f.seek(cut)
+            removed = f.read(size - cut).decode(code, errors="replace")
+        if (self.start_pending and cut < self.start_size) or cut < outf.own_from:
+            # The background count is still reading that part of the file,
+            # or someone else wrote it.
+            self.ui.notify()
+            return
+        journal = truncate_journal_path(self.filename)
+        journal.write_text("{} {} {}\n".format(size, cut, int(need_space)))
+        if not outf.truncate(cut):
+            journal.unlink()
+            self.ui.notify()
+            return
+        if need_space:
+            outf.write(" ")
+            outf.flush()
+        journal.unlink()
 
-    def _calculate_war(self):
-        check = time.perf_counter() - self.contest_starttime
-        self.contest_time = self.contest_data - check
-        self.contest_words = self.new_words - self.contest_startwords
-        self.contest_wpm = self.contest_words / (check / 60)
-        if self.contest_time <= 0:
-            self.contest_time = 0
-            self.ui.flash()
-            self.contest_mode = None
-
-    def _calculate_pomodoro(self): 
-        check = time.perf_counter() - self.contest_starttime
-        w = self.new_words - self.contest_startwords
-        if "rate" in self.pomodoro_during_run:
-            self.contest_wpm = w / (check / 60)
-        if "time" in self.pomodoro_during_run:
-            self.contest_time = self.contest_data - check
+        if self.was_seperator:
+            self.new_words -= 1
+            self.rate.add(self._rate_clock(), -1)
+        self.was_seperator = True
+        self.ui.unwrite(len(removed))
+        if need_space:
+            self.ui.write(" ")
+
+    def _start_contest(self, contest):
+        # Finished contests stay on show until the next one starts.
+        self.contests = [c for c in self.contests if c.end is None]
+        self.contests.append(contest)
+        self._schedule(contest.next_tick(time.perf_counter()),
+                       self._tick, contest)
+        goal = contest.goal()
+        if goal is not None:
+            self._timer_seq += 1
+            heapq.heappush(self._goals, (goal, self._timer_seq, contest))
+
+    def _clear_contests(self):
+        # Anything still running is dropped; its timers find it ended.
+        now = time.perf_counter()
+        for contest in self.contests:
+            if contest.end is None:
+                contest.end = now
+                contest.end_words = self.new_words
+        self.contests = []
+
+    def _schedule(self, when, action, item):
+        self._timer_seq += 1
+        heapq.heappush(self._timers, (when, self._timer_seq, action, item))
+
+    def _tick(self, contest, when, now):
+        if contest.end is not None:
+            return
+        end = contest.finish_time(now)
+        if end <= now and contest.goal() is None:
+            self._finish_contest(contest, end)
         else:
-            self.contest_time = '[' + "\\-/|"[int(time.perf_counter())%4] + ']'
-        if "words" in self.pomodoro_during_run:
-            self.contest_words = w
-        if check >= self.contest_data:
-            self.contest_words = w
-            self.contest_wpm = w / (check / 60)
-            self.contest_time = 0
-            self.ui.flash()
-            self.contest_mode = None
-
-    def _calculate_race(self):
-        check = self.new_words - self.contest_startwords
-        self.contest_words = self.contest_data - check
-        self.contest_time = time.perf_counter() - self.contest_starttime
-        self.contest_wpm = check / (self.contest_time / 60)
-        if check >= self.contest_data:
-            self.contest_words = 0
-            self.ui.flash()
-            self.contest_mode = None
+            self._schedule(contest.next_tick(now), self._tick, contest)
+
+    def _finish_contest(self, contest, end):
+        contest.end = end
+        contest.end_words = self.new_words
+        if contest is self.shared and self.war is not None:
+            # The server hears the final count right away.
+            self.war.progress = (contest.shared, contest.written(self.new_words))
+            self._war_report()
+        self.ui.notify(contest.summary(self.new_words))
+        duration = contest.elapsed(end)
+        written = contest.written(self.new_words)
+        start = time.time() - (time.perf_counter() - contest.start)
+        self.stats.add(contest.kind, start, duration, written,
+                       written / (duration / 60) if duration else 0.0)
+
+    def _schedule_sprints(self):
+        wall = time.time()
+        for rule in self.sprints:
+            # One already under way when ina starts isn't joined halfway.
+            hour, minute, length = rule
+            due = next_sprint(hour, minute, wall - length)
+            if due <= wall:
+                self._sprints_started[rule] = due
+            self._schedule_sprint(rule)
+
+    def _schedule_sprint(self, rule):
+        hour, minute, _ = rule
+        wall = time.time()
+        # The timer clock stops while the machine sleeps, so it's only
+        # trusted for a minute at a time before the wall clock is asked.
+        wait = min(next_sprint(hour, minute, wall) - wall, SPRINT_RECHECK)
+        self._schedule(time.perf_counter() + wait, self._start_sprint, rule)
+
+    def _start_sprint(self, rule, when, now):
+        hour, minute, length = rule
+        wall = time.time()
+        due = next_sprint(hour, minute, wall - length)
+        if due > wall:
+            # Not yet; only a recheck.
+            self._schedule_sprint(rule)
+            return
+        # Woken partway through, say after a suspend, it runs for what's
+        # left of it; one missed entirely is skipped.
+        if self._sprints_started.get(rule) != due:
+            self._sprints_started[rule] = due
+            self._start_contest(Sprint(now - (wall - due), self.new_words,
+                                       length))
+            self.ui.notify("Sprint: {} starting now".format(
+                human_duration(length)))
+        self._schedule_sprint(rule)
 
     def _run_contests(self):
-        if self.contest_mode == "war":
-            self._calculate_war()
-        elif self.contest_mode == "pomodoro":
-            self._calculate_pomodoro()
-        elif self.contest_mode == "race":
-            self._calculate_race()
+        now = time.perf_counter()
+        timers = self._timers
+        while timers and timers[0][0] <= now:
+            when, _, action, item = heapq.heappop(timers)
+            action(item, when, now)
+        goals = self._goals
+        while goals and goals[0][0] <= self.new_words:
+            contest = heapq.heappop(goals)[2]
+            if contest.end is None:
+                self._finish_contest(contest, now)
+        shared = self.shared
+        if self.war is not None and shared is not None and shared.end is None:
+            # Picked up by the reporter thread on its next round.
+            self.war.progress = (shared.shared, shared.written(self.new_words))
+
+    def _join_war(self):
+        try:
+            self.war = WarClient(self.war_address, self.war_name,
+                                 lambda message: self.ui.post(
+                                     lambda: self._war_message(message)))
+        except (OSError, ValueError):
+            self.war = None
+            self.ui.notify("Could not reach the word war server at {}".format(
+                self.war_address))
+
+    def _war_report(self):
+        try:
+            self.war.report()
+        except OSError:
+            self._war_message({"gone": True})
+
+    def _war_message(self, message):
+        if self.war is None:
+            return
+        if "gone" in message:
+            self.war.close()
+            self.war = None
+            self.board = None
+            self.ui.notify("Lost the word war server")
+        elif "start" in message:
+            spec = message["start"]
+            when = time.perf_counter() + spec["in"]
+            self._schedule(when, self._start_shared, spec)
+            if spec["in"] > 0:
+                self.ui.notify("{} starts in {:.0f} seconds".format(
+                    CONTEST_TITLES.get(spec["kind"], "Contest"), spec["in"]))
+        elif "board" in message:
+            if self.shared is not None and message["board"]["id"] == self.shared.shared:
+                self.board = message["rank"], message["board"]
+
+    def _start_shared(self, spec, when, now):
+        if spec["kind"] == "race":
+            contest = WordRace(when, self.new_words, spec["target"])
+        else:
+            contest = WordWar(when, self.new_words, spec["target"])
+        contest.shared = spec["id"]
+        self.shared = contest
+        self.board = None
+        self._start_contest(contest)
+        if contest.finish_time(now) <= now and contest.goal() is None:
+            self._finish_contest(contest, contest.finish_time(now))
+
+    def _board_text(self):
+        if self.board is None:
+            return None
+        rank, board = self.board
+        b = ["#{}/{}".format(rank, board["count"])]
+        if board["top"] and rank > 1:
+            b.append("{} {}".format(*board["top"][0]))
+        return " ".join(b)
 
     def loop(self, stdscr): 
         global code
-        key = None
         curses.use_default_colors()
         self.next_filename = self.filename
-        while self.next_filename is not None:
-            self.filename = self.next_filename
-            sys.stderr.write("\x1b]0;" + self.filename + "\x07")
-            sys.stderr.flush()
-
-            self.load(stdscr)
-            self._reload()
-            self.next_filename = None
-            with open(self.filename, "at") as outf:
-                while key != CTRL_X:
-                    self._run_key(outf, key)
-                    if outf.closed:
-                        key = None
-                        break
-                    self._run_contests()
-                    self._update_status()
-                    if self.ui.need_reset:
-                        self._reload(outf)
-                    key = self.ui.getch(timeout=0.2)
+        self.pending_keys = []
+        self.session_start = time.time()
+        self._rate_origin = time.perf_counter()
+        self._schedule_sprints()
+        try:
+            while self.next_filename is not None:
+                self.filename = self.next_filename
+                sys.stderr.write("\x1b]0;" + self.filename + "\x07")
+                sys.stderr.flush()
+
+                self.load(stdscr)
+                if self.war_address is not None and self.war is None:
+                    self._join_war()
+                recover_truncate(self.filename)
+                replay_journal(self.filename)
+                self._count_project()
+                self._reload()
+                self.next_filename = None
+                opened_words = self.new_words
+                with DurableOutput(self.filename, self.durability,
+                                   self.journal) as outf, \
+                        FileWatcher(self.filename, self._watch_callback(outf)):
+                    if self.profiler is not None:
+                        self.profiler.instrument(outf, "write", "file write")
+                        self.profiler.instrument(outf, "_drain", "flush")
+                    keys = self.pending_keys
+                    self.pending_keys = []
+                    while self._run_keys(outf, keys):
+                        if outf.closed:
+                            break
+                        self.ui.run_posted()
+                        self._absorb_foreign(outf)
+                        self._run_contests()
+                        self.ui.end_effects()
+                        if self.ui.need_reset:
+                            self.ui.redraw()
+                        self._update_status()
+                        keys = self.ui.getkeys(timeout=self._next_deadline())
+                self._remember_count(outf, opened_words)
+        finally:
+            if self.war is not None:
+                self.war.close()
+            if self.ui is not None:
+                self.ui.bracketed_paste(False)
+            self.stats.add("session", self.session_start,
+                           time.time() - self.session_start, self.new_words)
+
+    def _remember_count(self, outf, opened_words):
+        if self.start_pending:
+            return
+        partial = not self.was_seperator
+        words = self.start_words + self.new_words - opened_words + partial
+        self.word_index.remember(self.filename, outf.size(), words, partial)
+
+    def stream(self, source, out):
+        # Piped text follows the rules typed text does: control characters
+        # become the TODO marker and words are counted as they arrive. It
+        # is just never drawn, and it comes in much bigger pieces.
+        global code
+        recover_truncate(self.filename)
+        replay_journal(self.filename)
+        start_words, partial = 0, False
+        if os.path.exists(self.filename):
+            start_words, partial = self.word_index.count(self.filename)
+        started = partial
+        marker = self.todo_marker.encode(code, errors="replace")
+        ends = size = 0
+        held = b""
+        self.session_start = time.time()
+        report_at = time.perf_counter() + STREAM_REPORT_INTERVAL
+        progress = out.isatty()
+        with DurableOutput(self.filename, self.durability,
+                           self.journal) as outf:
+            eof = False
+            while not eof:
+                data, eof = read_chunk(source)
+                data = held + data
+                held = b""
+                if data.endswith(b"\r") and not eof:
+                    # It may be half of a \r\n.
+                    held, data = b"\r", data[:-1]
+                data, found, partial = stream_text(data, partial, marker)
+                outf.append(data)
+                size += len(data)
+                ends += found
+                if found:
+                    outf.end_word()
+                if outf.backlog() > STREAM_BACKLOG:
+                    outf.flush()
+                if progress and time.perf_counter() >= report_at:
+                    out.write("\r{:.1f} MB, {} words".format(size / (1 << 20),
+                                                             ends))
+                    out.flush()
+                    report_at += STREAM_REPORT_INTERVAL
+        duration = time.time() - self.session_start
+        self.new_words = ends + partial - started
+        self.word_index.remember(self.filename, outf.size(),
+                                 start_words + self.new_words, partial)
+        self.stats.add("session", self.session_start, duration, self.new_words)
+        if progress:
+            out.write("\r\x1b[K")
+        out.write("Appended {} words ({:.1f} MB) in {}; {} now has {} words.\n"
+                  .format(self.new_words, size / (1 << 20),
+                          human_duration(duration), self.filename,
+                          start_words + self.new_words))
+        return 0
+
+def stats_streaks(days, today):
+    import datetime
+    written = sorted(datetime.date.fromisoformat(day)
+                     for day, totals in days.items() if totals[0] > 0)
+    longest = run = 0
+    last = None
+    for date in written:
+        run = run + 1 if last is not None and (date - last).days == 1 else 1
+        longest = max(longest, run)
+        last = date
+    # Today still counts as part of the streak until it's over.
+    if last is None or (today - last).days > 1:
+        run = 0
+    return run, longest
+
+def load_settings(path):
+    # settings.conf is only parsed when it has changed; otherwise the
+    # validated result is read back from the cache next to it.
+    path = Path(path)
+    cache = path.with_name(".settings.cache.json")
+    try:
+        st = path.stat()
+        key = [st.st_mtime_ns, st.st_size]
+    except OSError:
+        key = None
+    try:
+        data = json.loads(cache.read_text())
+        if (data.get("version") == SETTINGS_CACHE_VERSION
+                and data.get("key") == key):
+            return data["settings"]
+    except (OSError, ValueError, AttributeError):
+        pass
+    settings = read_settings(path if key is not None else None)
+    tmp = cache.with_suffix(".new")
+    try:
+        tmp.write_text(json.dumps({"version": SETTINGS_CACHE_VERSION,
+                                   "key": key, "settings": settings}))
+        tmp.replace(cache)
+    except OSError:
+        pass
+    return settings
+
+def read_settings(path):
+    from configparser import ConfigParser
+    config = ConfigParser(inline_comment_prefixes=None)
+    if path is not None:
+        config.read(str(path))
+    if "general" not in config:
+        config.add_section("general")
+    general = config["general"]
+
+    def flag(name, default):
+        return general.get(name, default).strip().lower() not in ("false", "0", "no", "off", "")
+
+    settings = {
+        "pomodoro-during-run": None,
+        "pomodoro-time": general.get("pomodoro-time", DEFAULT_POMODORO_TIME).strip(),
+        "truncate-enabled": flag("truncate-enabled", "false"),
+        "tail-count": None,
+        "untitled-filename": general.get("untitled-filename", DEFAULT_UNTITLED_FILENAME).strip(),
+        "todo-marker": general.get("todo-marker", DEFAULT_TODO_MARKER),
+        "wrap-margin": int(DEFAULT_WRAP_MARGIN),
+        "notification": general.get("notification", DEFAULT_NOTIFICATION).strip().lower(),
+        "durability": general.get("durability", DEFAULT_DURABILITY).strip(),
+        "journal": flag("journal", "true"),
+        "status-diff": flag("status-diff", "true"),
+        "profile": general.get("profile", "off").strip(),
+        "sprints": general.get("sprints", "").strip(),
+        "war-name": general.get("war-name", "").strip(),
+    }
+    if "pomodoro-during-run" in general:
+        settings["pomodoro-during-run"] = general["pomodoro-during-run"].split()
+    if "tail-count" in general:
+        tc = general["tail-count"].strip().split()
+        try:
+            settings["tail-count"] = [int(tc[0]), tc[1] if len(tc) > 1 else "char"]
+        except (ValueError, IndexError):
+            pass
+    try:
+        settings["wrap-margin"] = int(general.get("wrap-margin", DEFAULT_WRAP_MARGIN))
+    except ValueError:
+        pass
+    if settings["notification"] not in NOTIFICATION_MODES:
+        settings["notification"] = DEFAULT_NOTIFICATION
+    return settings
+
+def parse_durability(text):
+    words = text.lower().split()
+    mode = words[0] if words else DEFAULT_DURABILITY
+    if mode not in DURABILITY_MODES:
+        mode = DEFAULT_DURABILITY
+    interval = (DEFAULT_IDLE_MS if mode == "idle" else DEFAULT_BATCH_MS) / 1000
+    max_bytes = DEFAULT_BATCH_BYTES
+    fsync = False
+    for word in words[1:]:
+        try:
+            if word == "fsync":
+                fsync = True
+            elif word.endswith("ms"):
+                interval = int(word[:-2]) / 1000
+            elif word.endswith("bytes"):
+                max_bytes = int(word[:-5])
+            elif word.endswith("b"):
+                max_bytes = int(word[:-1])
+        except ValueError:
+            pass
+    return mode, interval, max_bytes, fsync
+
+def parse_sprints(text):
+    # ":00 20" is a 20 minute sprint on every hour, "14:30 1:00" an hour
+    # long one every day at half past two.
+    rules = []
+    for entry in text.split(","):
+        words = entry.split()
+        if len(words) != 2 or ":" not in words[0]:
+            continue
+        hour, minute = words[0].split(":", 1)
+        try:
+            hour = int(hour) if hour else None
+            minute = int(minute)
+            length = from_human_duration(words[1], minutes=True)
+        except ValueError:
+            continue
+        if (hour is None or 0 <= hour < 24) and 0 <= minute < 60 and length > 0:
+            rules.append((hour, minute, length))
+    return rules
+
+def next_sprint(hour, minute, now):
+    t = time.localtime(now)
+    day = (t.tm_year, t.tm_mon, t.tm_mday)
+    when = time.mktime(day + (t.tm_hour if hour is None else hour, minute,
+                              0, 0, 0, -1))
+    if when <= now:
+        if hour is None:
+            when += 3600
+        else:
+            when = time.mktime(day[:2] + (day[2] + 1, hour, minute,
+                                          0, 0, 0, -1))
+    return when
+
+def _changed_spans(old, new):
+    spans = []
+    start = None
+    gap = 0
+    for i, (a, b) in enumerate(zip(old, new)):
+        if a != b:
+            if start is None:
+                start = i
+            gap = 0
+            end = i + 1
+        elif start is not None:
+            gap += 1
+            # A cursor motion costs about as much as a few cells, so
+            # rewrite short unchanged gaps instead of jumping over them.
+            if gap > STATUS_SPAN_GAP:
+                spans.append((start, end))
+                start = None
+    if start is not None:
+        spans.append((start, end))
+    return spans
+
+def journal_path(filename, pid=None):
+    fn = Path(filename)
+    if pid is None:
+        return fn.parent / ".{}.ina-journal".format(fn.name)
+    return fn.parent / ".{}.{}.ina-journal".format(fn.name, pid)
+
+def _abandoned_journals(filename):
+    fn = Path(filename)
+    prefix = ".{}.".format(fn.name)
+    try:
+        names = [e.name for e in os.scandir(fn.parent or ".")
+                 if e.name.startswith(prefix) and e.name.endswith(".ina-journal")]
+    except OSError:
+        return
+    for name in names:
+        middle = name[len(prefix):-len(".ina-journal")]
+        if middle and not middle.isdigit():
+            continue
+        try:
+            fd = os.open(str(fn.parent / name), os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Another ina is still writing this file.
+            os.close(fd)
+            continue
+        yield fn.parent / name, fd
+
+def _journal_record(offset, data):
+    head = struct.pack("<IQ", len(data), offset)
+    return JOURNAL_RECORD.pack(zlib.crc32(data, zlib.crc32(head)),
+                               len(data), offset) + data
+
+def replay_journal(filename):
+    replayed = 0
+    for journal, fd in _abandoned_journals(filename):
+        try:
+            with os.fdopen(fd, "rb") as jf:
+                data = jf.read()
+                replayed += _replay(filename, data)
+                journal.unlink()
+        except OSError:
+            pass
+    return replayed
+
+def _replay(filename, data):
+    view = memoryview(data)
+    replayed = []
+    with open(filename, "ab+") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        size = os.fstat(f.fileno()).st_size
+        end = size
+        pos = 0
+        while pos + JOURNAL_RECORD.size <= len(data):
+            crc, length, offset = JOURNAL_RECORD.unpack_from(data, pos)
+            body = pos + JOURNAL_RECORD.size
+            if body + length > len(data):
+                break
+            # The checksum covers the length and offset, so a torn or
+            # garbled record ends the replay.
+            if zlib.crc32(view[body:body + length],
+                          zlib.crc32(view[pos + 4:body])) != crc:
+                break
+            pos = body + length
+            if offset + length <= size:
+                continue
+            if offset > end:
+                break
+            if offset < size:
+                f.seek(offset)
+                if f.read(size - offset) != data[body:body + size - offset]:
+                    break
+            replayed.append(view[body + end - offset:pos])
+            end = offset + length
+        if replayed:
+            f.seek(0, os.SEEK_END)
+            f.write(b"".join(replayed))
+    return end - size
+
+def _inotify_watch(filename):
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1")
+    if libc.inotify_add_watch(fd, os.fsencode(filename), IN_MODIFY) < 0:
+        errno = ctypes.get_errno()
+        os.close(fd)
+        raise OSError(errno, "inotify_add_watch")
+    return fd
+
+def _is_backup(name):
+    suffix = Path(name).suffix
+    return (suffix == ".bak" or suffix.endswith("~") or suffix.startswith("~")
+            or suffix.endswith("#"))
+
+def _split_number(name):
+    fn = Path(name)
+    got = NUMBER.findall(fn.stem)
+    if len(got) != 1:
+        return None
+    m = NUMBER.search(name)
+    return name[:m.start()], m.group(), name[m.end():]
+
+def parse_address(text):
+    # A socket path, or [host]:port with the host defaulting to this
+    # machine. A write-in on a LAN serves on 0.0.0.0:port.
+    if "/" in text or ":" not in text:
+        return "unix", text
+    host, _, port = text.rpartition(":")
+    if not port.isdigit() or int(port) > 65535:
+        raise ValueError("{} is not a port number".format(port))
+    return "tcp", (host or "localhost", int(port))
+
+def remove_socket(where):
+    # Only ever a stale socket: a path given by mistake may well be the
+    # manuscript. None when there was nothing there.
+    import stat
+    try:
+        mode = os.lstat(where).st_mode
+    except FileNotFoundError:
+        return None
+    if not stat.S_ISSOCK(mode):
+        return False
+    os.unlink(where)
+    return True
+
+def connect_address(text):
+    import socket
+    family, where = parse_address(text)
+    if family == "unix":
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(where)
+        return sock
+    return socket.create_connection(where)
+
+def serve(address, source, out):
+    import asyncio
+    try:
+        asyncio.run(WarServer(out).run(address, source))
+    except KeyboardInterrupt:
+        pass
+    except (OSError, ValueError) as e:
+        sys.stderr.write("ina: can't serve on {}: {}\n".format(address, e))
+        return 1
+    return 0
+
+def read_chunk(source):
+    # Whatever has arrived, up to STREAM_CHUNK: a file fills the chunk, a
+    # slow pipe (say, dictation) hands over each piece as it comes.
+    buf = bytearray()
+    while len(buf) < STREAM_CHUNK:
+        data = source.read1(STREAM_CHUNK - len(buf))
+        if not data:
+            return bytes(buf), True
+        buf += data
+        if not select.select([source], [], [], 0)[0]:
+            break
+    return bytes(buf), False
+
+def stream_text(data, partial, marker):
+    # Returns the text to append and how many words end in it, along with
+    # whether it ends inside a word.
+    # Piped line breaks are taken the way a paste's are.
+    if b"\r" in data:
+        data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+    marks = data.translate(STREAM_MARKS)
+    if b"\x02" not in marks:
+        return (data,) + count_marks(marks, partial)
+    out = []
+    was_partial = partial
+    for i, piece in enumerate(STREAM_CONTROLS.split(data)):
+        if i:
+            if partial:
+                out.append(b" ")
+            out.append(marker + b" ")
+            partial = False
+        if piece:
+            out.append(piece)
+            partial = WORD_MARKS[piece[-1]] == 1
+    data = b"".join(out)
+    return (data,) + count_words(data, was_partial)
+
+def count_words(data, partial=False):
+    # Counts the words that end within data, given whether one was already
+    # in progress. Separators are all ASCII, so this works on the encoded
+    # bytes: every byte becomes 0 or 1 and a word ends at each 1, 0 pair.
+    return count_marks(data.translate(WORD_MARKS), partial)
+
+def count_marks(marks, partial=False):
+    ends = marks.count(b"\x01\x00")
+    if partial and marks[:1] == b"\x00":
+        ends += 1
+    if marks:
+        partial = marks[-1] == 1
+    return ends, partial
+
+def _count_stream(f, words=0, partial=False, length=None):
+    # words includes an unfinished last word, as the index stores it.
+    ends = words - partial
+    while True:
+        if length is None:
+            block = f.read(WORD_INDEX_CHUNK)
+        else:
+            block = f.read(min(WORD_INDEX_CHUNK, length))
+            length -= len(block)
+        if not block:
+            return ends + partial, partial
+        got, partial = count_words(block, partial)
+        ends += got
+
+def truncate_journal_path(filename):
+    fn = Path(filename)
+    return fn.parent / ".{}.ina-truncate".format(fn.name)
+
+def recover_truncate(filename):
+    journal = truncate_journal_path(filename)
+    try:
+        size, cut, need_space = (int(n) for n in journal.read_text().split())
+    except OSError:
+        return
+    except ValueError:
+        journal.unlink()
+        return
+    # Roll an interrupted word-delete forward, unless the file has been
+    # changed, moved or deleted by something else since. Either way the
+    # journal is done with.
+    try:
+        with open(filename, "r+b") as f:
+            current = os.fstat(f.fileno()).st_size
+            if current in (size, cut):
+                f.truncate(cut)
+                if need_space:
+                    f.seek(cut)
+                    f.write(b" ")
+    except FileNotFoundError:
+        pass
+    journal.unlink()
+
+def _find_word_start(f, size):
+    # Words end where count_words says they do. A hyphen is kept, so
+    # "well-known" goes back to "well-" rather than "well ".
+    separators = WORD_SEPARATORS.encode()
+    pos = size
+    in_word = False
+    while pos > 0:
+        step = min(TRUNCATE_WINDOW, pos)
+        f.seek(pos - step)
+        block = f.read(step)
+        for i in range(len(block) - 1, -1, -1):
+            if block[i] in separators:
+                if in_word:
+                    if block[i] == ord("-"):
+                        return pos - step + i + 1, False
+                    return pos - step + i, True
+            else:
+                in_word = True
+        pos -= step
+    return 0, False
+
+def read_tail(filename, count, tail_type):
+    kind = TAIL_TYPES.get(tail_type)
+    if kind is None:
+        kind = "chars"
+        count = DEFAULT_TAIL_COUNT
+    try:
+        f = open(filename, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        blocks = []
+        checkpoint = TAIL_BLOCK_SIZE
+        while True:
+            step = min(TAIL_BLOCK_SIZE, pos)
+            pos -= step
+            f.seek(pos)
+            blocks.append(f.read(step))
+            done = end - pos
+            # Only re-examine the window each time it doubles, so a tail
+            # that needs many blocks still costs O(window) overall.
+            if pos > 0 and done < checkpoint:
+                continue
+            checkpoint *= 2
+            whole = pos == 0 or done >= TAIL_READ_LIMIT
+            blocks.reverse()
+            data = b"".join(blocks)
+            blocks = [data]
+            ret = _cut_tail(_decode_tail(data, pos == 0), count, kind, whole)
+            if ret is not None:
+                return ret
+
+def _decode_tail(data, at_start):
+    global code
+    if not at_start:
+        # Skip the continuation bytes of a multibyte character that was
+        # split by the block boundary.
+        skip = 0
+        while skip < 3 and skip < len(data) and data[skip] & 0xC0 == 0x80:
+            skip += 1
+        data = data[skip:]
+    text = data.decode(code, errors="replace")
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+def _cut_tail(text, count, kind, whole):
+    # The first word, line or paragraph of a partial window may have been
+    # cut by the block boundary, so it never counts toward the total.
+    if kind == "words":
+        if not whole and len(text.split()) <= count:
+            return None
+        t = text.replace("\n\n"," [NEW-PARAGRAPH]").split()[-count:]
+        ret = " ".join(t).replace(" [NEW-PARAGRAPH]", "\n\n")
+        if not text.endswith("\n\n") and text.endswith("\n"):
+            ret = ret + "\n"
+        elif text.endswith(" "):
+            ret = ret + " "
+    elif kind == "lines":
+        t = text.split("\n")
+        if not whole and len(t) <= count:
+            return None
+        ret = "\n".join(t[-count:])
+    elif kind == "paras":
+        t = text.split("\n\n")
+        if not whole:
+            del t[0]
+        r = []
+        t.reverse()
+        for para in t:
+            para = para.strip()
+            if para == "":
+                continue
+            r.append(para)
+            if len(r) >= count:
+                break
+        if not whole and len(r) < count:
+            return None
+        r.reverse()
+        if text.endswith("\n\n"):
+            r.append("")
+            ret = "\n\n".join(r)
+        elif text.endswith("\n"):
+            ret = "\n\n".join(r) + "\n"
+        elif text.endswith(" "):
+            ret = "\n\n".join(r) + " "
+        else:
+            ret = "\n\n".join(r)
+    else:
+        if not whole and len(text) < count:
+            return None
+        ret = text[-count:]
+    return ret
+
+def rate_histogram(typing, idle, width=80):
+    # Bursts of typing next to the pauses between them, by length.
+    last = max(i for i in range(RATE_BUCKETS) if typing[i] or idle[i])
+    bar = max(1, min(RATE_BAR, (width - 22) // 2))
+    top = max(typing + idle)
+    row = "{:>6}  {:>5} {:<{bar}}  {:>5} {}"
+    lines = [row.format("", "", "typing", "", "idle", bar=bar)]
+    for i in range(last + 1):
+        seconds = 1 << i
+        if seconds < 60:
+            label = "{}s".format(seconds)
+        else:
+            label = "{}m".format(seconds // 60)
+        if i == RATE_BUCKETS - 1:
+            label += "+"
+        lines.append(row.format(
+            label, typing[i], "#" * -(-typing[i] * bar // top),
+            idle[i], "#" * -(-idle[i] * bar // top), bar=bar).rstrip())
+    return lines
 
 def from_human_duration(code, *, minutes = False):
     if code is None or isinstance(code, int) or isinstance(code,float) or code == "":
@@ -947,5 +3514,16 @@ def human_duration(seconds, floor=0):
 
 if __name__ == "__main__":
     ina = IdioticNanowrimoAppender(sys.argv[1:])
-    curses.wrapper(ina.loop)
+    if ina.show_stats:
+        print(ina.stats.report())
+        sys.exit(0)
+    if ina.from_stdin:
+        sys.exit(ina.stream(sys.stdin.buffer, sys.stderr))
+    if ina.serve_address is not None:
+        sys.exit(serve(ina.serve_address, sys.stdin, sys.stdout))
+    try:
+        curses.wrapper(ina.loop)
+    finally:
+        if ina.profiler is not None:
+            ina.profiler.finish(sys.stderr)
 
@@ -0,0 +1,54 @@
+import time
+
+import ina
+
+
+class QuietUi:
+    def shared_write(self, outf, text):
+        outf.write(text)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def test_typing_after_a_hyphen(tmp_path):
+    book = tmp_path / "book.txt"
+    book.write_text("well-")
+    app = ina.IdioticNanowrimoAppender(
+        ["--user-config", str(tmp_path / "home"), str(book)])
+    app.ui = QuietUi()
+    app.start_time = time.perf_counter()
+    app._reload()
+    with ina.DurableOutput(str(book), journal=False) as outf:
+        app._do_input(outf, " x ")
+    assert app.new_words == 1
+    assert ina.count_words(book.read_bytes()) == (2, False)
+
+
+def test_edit_then_append_is_recounted(tmp_path):
+    book = tmp_path / "book.txt"
+    book.write_text("one two three four ")
+    index = ina.WordCountIndex(tmp_path / "wordcounts.json")
+    assert index.count(str(book)) == (4, False)
+    book.write_text("onetwo three four five ")
+    assert ina.WordCountIndex(tmp_path / "wordcounts.json").count(
+        str(book)) == (4, False)
+
+
+def test_remembered_session_count(tmp_path):
+    book = tmp_path / "book.txt"
+    book.write_text("one two")
+    index = ina.WordCountIndex(tmp_path / "wordcounts.json")
+    index.remember(str(book), book.stat().st_size, 2, True)
+    assert index.cached(str(book)) == (2, True)
+    index.remember(str(book), book.stat().st_size + 1, 3, False)
+    assert index.cached(str(book)) == (2, True)
+
+
+def test_truncate_journal_for_a_missing_file(tmp_path):
+    book = tmp_path / "book.txt"
+    journal = ina.truncate_journal_path(str(book))
+    journal.write_text("10 4 1\n")
+    ina.recover_truncate(str(book))
+    assert not journal.exists()
+    assert not book.exists()